@@ -0,0 +1,356 @@
+'''
+Benchmark of Metadata_Compare8.py on synthetic HFM metadata files.
+
+Production metadata cannot be shared, so this script generates a pair of metadata files, a baseline and a variant of
+it with a given share of added, removed, changed and reordered lines, and times every stage of the comparison
+separately on them:
+1) trim     - reading the files and removing the spaces around the fields
+2) split    - splitting the trimmed lines by section
+3) diff     - finding the differing lines of every section
+4) compare  - comparing the differing lines and producing the result rows
+5) report   - writing the rows to the results workbook
+
+Each size is run once for the timings and, unless --no-memory is given, once more under tracemalloc for the peak
+memory of every stage, so that the timings are not slowed down by the memory tracing. The results are written to a
+JSON file, a previous JSON file can be given with --compare to print the change of every stage against it.
+
+Command to run the script:
+==========================
+python Metadata_Benchmark.py
+    runs the default sizes 1000, 10000 and 100000 members
+python Metadata_Benchmark.py --sizes 1000 10000 100000 1000000 --output before.json
+python Metadata_Benchmark.py --sizes 100000 --customs 6 --depth 8 --changed 0.05 --compare before.json
+python Metadata_Benchmark.py --members Account=50000 Entity=20000 Custom1=1000 --keep
+    the member count of every dimension can be given instead of a total size, --keep leaves the generated files
+python Metadata_Benchmark.py --sizes 1000000 --workers 4 --no-memory
+    also times the read of the baseline in chunks on 4 worker processes against the serial read, the speedup depends
+    on the number of CPUs the process can use, which is written to the results
+'''
+
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import textwrap
+import time
+import tracemalloc
+from datetime import datetime
+
+import Metadata_Compare8 as metadataCompare
+
+
+'''
+Generator of the synthetic metadata files. Members get the properties of their dimension from the property arrays of
+Metadata_Compare8, so the files follow the layout the comparison expects for the given number of custom dimensions.
+The hierarchies are balanced trees of the given depth under #root, the Entity hierarchy has no aggregation weight.
+'''
+def getCustomOrder(customs):
+	return ["Custom" + str(customNumber) for customNumber in range(1, customs + 1)]
+
+def getMemberCounts(size, customs):
+	memberCounts = {"Account": int(size * 0.4), "Entity": int(size * 0.3), "Scenario": min(10, size)}
+	for customName in getCustomOrder(customs):
+		memberCounts[customName] = max(1, int(size * 0.3 / customs))
+	return memberCounts
+
+def getGeneratedValue(propertyName, label, randomGenerator):
+	if propertyName == "Label":
+		return label
+	if propertyName == "DefaultParent":
+		return "DefaultParent=#root"
+	if propertyName == "Descriptions":
+		return "English=" + label + " description"
+	if propertyName.startswith("Is") or propertyName.startswith("Enable") or propertyName.startswith("Uses"):
+		return randomGenerator.choice(["Y", "N"])
+	if propertyName.endswith("TopMember"):
+		return "[None]"
+	if propertyName.startswith("UserDefined"):
+		return randomGenerator.choice(["", "UD" + str(randomGenerator.randint(1, 50))])
+	return randomGenerator.choice(["", "A", "B", "C", "0", "1"])
+
+def getMemberLabel(dimensionName, memberNumber):
+	return dimensionName[:3].upper() + str(memberNumber).zfill(7)
+
+def generateSections(memberCounts, depth, customs, randomGenerator):
+	customOrder = getCustomOrder(customs)
+	aPropertyArrays = metadataCompare.getPropertyArrays(tuple(customOrder))
+	sections = {"APPLICATION_SETTINGS": ["DefaultCurrency=USD", "DefaultRateForBalanceAccounts=EOM", "OrgByPeriodApplication=N"],
+		"CURRENCIES": [currency + ";0;;N;English=" + currency for currency in ["USD", "EUR", "GBP", "JPY", "CAD"]]}
+	for dimensionName, memberCount in memberCounts.items():
+		aPropertyArray = aPropertyArrays["CUSTOM" if dimensionName in customOrder else dimensionName.upper()]
+		sections[dimensionName + "M"] = [";".join(getGeneratedValue(propertyName, getMemberLabel(dimensionName, memberNumber), randomGenerator)
+			for propertyName in aPropertyArray) for memberNumber in range(memberCount)]
+		branching = max(2, int(math.ceil(memberCount ** (1.0 / max(depth, 1)))))
+		edges = []
+		for memberNumber in range(memberCount):
+			parent = "#root" if memberNumber == 0 else getMemberLabel(dimensionName, (memberNumber - 1) // branching)
+			edge = parent + ";" + getMemberLabel(dimensionName, memberNumber)
+			edges.append(edge if dimensionName == "Entity" else edge + ";1")
+		sections[dimensionName + "H"] = edges
+	sections["CONSOLIDATION_METHODS"] = ["Proportional;N;N;0;0;100;Proportional;English=Proportional"]
+	return sections
+
+def getAddedLine(line, lineNumber):
+	fields = line.split(";")
+	label = "NEW" + str(lineNumber).zfill(7)
+	if len(fields) == 1:
+		return label + "=" + line.split("=")[-1]
+	if len(fields) < 4:
+		fields[1] = label
+	else:
+		fields[0] = label
+	return ";".join(fields)
+
+def getSectionHeader(sectionName):
+	if sectionName in ["APPLICATION_SETTINGS", "CURRENCIES", "CONSOLIDATION_METHODS"]:
+		return "!" + sectionName
+	if sectionName[-1] == "M":
+		return "!MEMBERS=" + sectionName[:-1]
+	return "!HIERARCHIES=" + sectionName[:-1]
+
+def generateVariant(sections, added, removed, changed, reordered, randomGenerator):
+	variant = {}
+	for sectionName, lines in sections.items():
+		lines = [line for line in lines if randomGenerator.random() >= removed]
+		for lineNumber in range(len(lines)):
+			if randomGenerator.random() < changed:
+				fields = lines[lineNumber].split(";")
+				if len(fields) > 1:
+					fieldNumber = randomGenerator.randint(1, len(fields) - 1)
+					fields[fieldNumber] = fields[fieldNumber] + "X"
+					lines[lineNumber] = ";".join(fields)
+		for lineNumber in range(int(len(lines) * added)):
+			lines.insert(randomGenerator.randint(0, len(lines)), getAddedLine(randomGenerator.choice(lines), lineNumber))
+		positions = [lineNumber for lineNumber in range(len(lines)) if randomGenerator.random() < reordered]
+		shuffledPositions = positions[:]
+		randomGenerator.shuffle(shuffledPositions)
+		reorderedLines = lines[:]
+		for position, shuffledPosition in zip(positions, shuffledPositions):
+			reorderedLines[position] = lines[shuffledPosition]
+		variant[sectionName] = reorderedLines
+	return variant
+
+def writeMetadataFile(metadataFilePath, sections, customs, randomGenerator):
+	with open(metadataFilePath, "w", encoding="cp1252", newline="\r\n") as metadataFile:
+		metadataFile.write("!FILE_FORMAT=11.12\n!VERSION=11.1.6100\n!CUSTOM_ORDER=" + ";".join(getCustomOrder(customs)) + "\n\n")
+		for sectionName, lines in sections.items():
+			metadataFile.write(getSectionHeader(sectionName) + "\n")
+			for line in lines:
+				if randomGenerator.random() < 0.1:
+					line = " ; ".join(line.split(";"))
+				metadataFile.write(line + "\n")
+			metadataFile.write("\n")
+
+def generateMetadataFiles(folder, memberCounts, depth=5, customs=4, added=0.01, removed=0.01, changed=0.02, reordered=0.0, seed=1):
+	randomGenerator = random.Random(seed)
+	sections = generateSections(memberCounts, depth, customs, randomGenerator)
+	variant = generateVariant(sections, added, removed, changed, reordered, randomGenerator)
+	baselineFile = getFullPath(folder, "Baseline_Metadata.app")
+	variantFile = getFullPath(folder, "Variant_Metadata.app")
+	writeMetadataFile(baselineFile, sections, customs, randomGenerator)
+	writeMetadataFile(variantFile, variant, customs, randomGenerator)
+	return baselineFile, variantFile
+
+def getFullPath(folderPath, fileToJoin):
+	return os.path.join(folderPath, fileToJoin)
+
+
+'''
+Stages of the comparison, they are run in sequence on the output of the previous stage with the same functions the
+in-memory pipeline of Metadata_Compare8 uses.
+'''
+def runTrim(state):
+	state["trimmed"] = []
+	for metadataFilePath in state["files"]:
+		with open(metadataFilePath, encoding="cp1252") as metadataFile:
+			state["trimmed"].append([metadataCompare.trimLine(line) for line in metadataFile])
+	return sum(len(trimmedLines) for trimmedLines in state["trimmed"])
+
+def runSplit(state):
+	state["sections"] = [metadataCompare.splitSections(trimmedLines) for trimmedLines in state.pop("trimmed")]
+	return sum(len(lines) for sections in state["sections"] for lines in sections.values())
+
+def runDiff(state):
+	sections1, sections2 = state["sections"]
+	state["differences"] = {}
+	for sectionName in sections1:
+		if sectionName in sections2:
+			state["differences"][sectionName] = metadataCompare.findSectionDifferences(sections1[sectionName], sections2[sectionName])
+	return sum(len(differences1) + len(differences2) for differences1, differences2 in state["differences"].values())
+
+def runCompare(state):
+	customOrder = metadataCompare.getCustomOrder(state["files"][0])
+	state["rows"] = []
+	for sectionName, (differences1, differences2) in state["differences"].items():
+		sectionLines = (state["sections"][0][sectionName], state["sections"][1][sectionName])
+		state["rows"].extend(metadataCompare.compareSection(sectionName, differences1, differences2, customOrder, sectionLines))
+	return len(state["rows"])
+
+def runReport(state):
+	header = ["Dimension", "Member Name", "Property", "Baseline_Metadata", "Variant_Metadata"]
+	metadataCompare.writeToResultsFile(getFullPath(state["folder"], "Results.xlsx"), [header] + state["rows"])
+	return len(state["rows"])
+
+stages = [("trim", runTrim), ("split", runSplit), ("diff", runDiff), ("compare", runCompare), ("report", runReport)]
+
+'''
+Metadata_Compare8 imports numpy and openpyxl the first time they are needed, they are imported once before the stages
+are timed so that the compare and report stages of the first size do not include the imports.
+'''
+def importComparisonModules():
+	metadataCompare.getNumpy()
+	import openpyxl.cell
+	import openpyxl.styles
+
+def runStages(folder, files, traceMemory):
+	state = {"folder": folder, "files": files}
+	results = {}
+	for stageName, runStage in stages:
+		if traceMemory:
+			tracemalloc.reset_peak()
+			memoryBefore = tracemalloc.get_traced_memory()[0]
+		startTime = time.perf_counter()
+		records = runStage(state)
+		seconds = time.perf_counter() - startTime
+		results[stageName] = {"seconds": round(seconds, 4), "records": records}
+		if traceMemory:
+			results[stageName]["peak_memory_mb"] = round((tracemalloc.get_traced_memory()[1] - memoryBefore) / 1024 / 1024, 2)
+	return results
+
+'''
+With --workers the baseline is also read the way the in-memory mode reads a file bigger than the chunk size on its
+workers, in line-aligned chunks with the partial indexes of the sections which span several chunks merged, against the
+serial read and index of the same sections. The pool is started before the timing, as it is by the in-memory mode.
+'''
+def runChunkedRead(baselineFile, workers, chunkSize):
+	from concurrent.futures import ProcessPoolExecutor
+	startTime = time.perf_counter()
+	sections = metadataCompare.readSections(baselineFile)
+	sectionNames = [sectionName for sectionName, lines in sections.items() if len(lines) > 1]
+	for sectionName in sectionNames:
+		metadataCompare.indexBaselineSection(sections[sectionName])
+	serialSeconds = time.perf_counter() - startTime
+	metadataCompare.parseChunkSize = chunkSize
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		list(executor.map(abs, range(workers)))
+		startTime = time.perf_counter()
+		sectionIndexes = {}
+		chunkedSections = metadataCompare.readSectionsInChunks(baselineFile, executor, sectionIndexes)
+		chunkedSeconds = time.perf_counter() - startTime
+	if chunkedSections != sections:
+		raise Exception("The chunked read of " + baselineFile + " differs from the serial read")
+	return {"workers": workers, "cpus": metadataCompare.getCpuCount(), "chunks": len(metadataCompare.getChunkRanges(baselineFile, chunkSize)),
+		"merged_sections": len(sectionIndexes), "serial_seconds": round(serialSeconds, 4), "chunked_seconds": round(chunkedSeconds, 4)}
+
+def runBenchmark(memberCounts, args):
+	folder = tempfile.mkdtemp(prefix="Metadata_Benchmark_")
+	try:
+		startTime = time.perf_counter()
+		files = generateMetadataFiles(folder, memberCounts, args["depth"], args["customs"], args["added"], args["removed"],
+			args["changed"], args["reordered"], args["seed"])
+		generateSeconds = time.perf_counter() - startTime
+		stageResults = runStages(folder, files, False)
+		if not args["no_memory"]:
+			tracemalloc.start()
+			try:
+				for stageName, memoryResult in runStages(folder, files, True).items():
+					stageResults[stageName]["peak_memory_mb"] = memoryResult["peak_memory_mb"]
+			finally:
+				tracemalloc.stop()
+		chunkedRead = runChunkedRead(files[0], args["workers"], args["chunk_size"]) if args["workers"] > 1 else None
+		for stageResult in stageResults.values():
+			stageResult["records_per_sec"] = round(stageResult["records"] / stageResult["seconds"]) if stageResult["seconds"] else None
+		return {"members": sum(memberCounts.values()), "member_counts": memberCounts,
+			"file_bytes": [os.path.getsize(metadataFile) for metadataFile in files],
+			"generate_seconds": round(generateSeconds, 4), "stages": stageResults, "chunked_read": chunkedRead}
+	finally:
+		if args["keep"]:
+			print("INFO: generated files are kept in " + folder)
+		else:
+			shutil.rmtree(folder, ignore_errors=True)
+
+
+def printResult(result, previousResult=None):
+	print(20 * "*")
+	print("{} members, files of {} bytes".format(result["members"], " and ".join(str(fileBytes) for fileBytes in result["file_bytes"])))
+	print("{:<10}{:>12}{:>12}{:>14}{:>12}{:>10}".format("stage", "seconds", "records", "records/sec", "peak MB", "change"))
+	for stageName, stageResult in result["stages"].items():
+		change = ""
+		if previousResult is not None and stageName in previousResult["stages"] and previousResult["stages"][stageName]["seconds"]:
+			change = "{:+.1%}".format(stageResult["seconds"] / previousResult["stages"][stageName]["seconds"] - 1)
+		print("{:<10}{:>12}{:>12}{:>14}{:>12}{:>10}".format(stageName, stageResult["seconds"], stageResult["records"],
+			str(stageResult["records_per_sec"]), str(stageResult.get("peak_memory_mb", "")), change))
+	chunkedRead = result.get("chunked_read")
+	if chunkedRead:
+		print("read of the baseline in {} chunks on {} workers, {} CPUs: {} seconds, serial read {} seconds".format(chunkedRead["chunks"],
+			chunkedRead["workers"], chunkedRead["cpus"], chunkedRead["chunked_seconds"], chunkedRead["serial_seconds"]))
+
+def process():
+	parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=textwrap.dedent('''
+				Benchmark of the stages of Metadata_Compare8.py on synthetic HFM metadata files'''))
+	parser.add_argument('--sizes', help='Total number of members of the generated files, one benchmark is run per size.\
+	default is 1000 10000 100000', nargs='+', type=int, default=[1000, 10000, 100000])
+	parser.add_argument('--members', help='Number of members per dimension, for ex: Account=50000 Entity=20000, runs one\
+	benchmark with these counts instead of --sizes. The dimensions are Account, Entity, Scenario and Custom1 to the\
+	number of --customs', nargs='+', default=[])
+	parser.add_argument('--depth', help='Depth of the hierarchies. default is 5', type=int, default=5)
+	parser.add_argument('--customs', help='Number of custom dimensions. default is 4', type=int, default=4)
+	parser.add_argument('--added', help='Share of lines added in the variant. default is 0.01', type=float, default=0.01)
+	parser.add_argument('--removed', help='Share of lines removed in the variant. default is 0.01', type=float, default=0.01)
+	parser.add_argument('--changed', help='Share of lines changed in the variant. default is 0.02', type=float, default=0.02)
+	parser.add_argument('--reordered', help='Share of lines moved to another position in the variant. default is 0',
+		type=float, default=0.0)
+	parser.add_argument('--seed', help='Seed of the generator. default is 1', type=int, default=1)
+	parser.add_argument('--no-memory', help='Do not measure the peak memory of the stages', action='store_true')
+	parser.add_argument('--workers', help='Also time the read of the baseline in chunks on this number of worker processes.\
+	default is 1, no chunked read', type=int, default=1)
+	parser.add_argument('--chunk-size', help='Size in bytes of the chunks of --workers. default is the chunk size of\
+	Metadata_Compare8, 4 MB', type=int, default=metadataCompare.parseChunkSize)
+	parser.add_argument('--keep', help='Keep the generated metadata files', action='store_true')
+	parser.add_argument('--output', help='JSON file the results are written to. default is\
+	Metadata_Benchmark_<timestamp>.json in the current working directory', default='')
+	parser.add_argument('--compare', help='JSON file of a previous benchmark to compare the timings with', default='')
+	args = vars(parser.parse_args())
+
+	if args["members"]:
+		dimensionNames = ["Account", "Entity", "Scenario"] + getCustomOrder(args["customs"])
+		memberCounts = {}
+		for memberCount in args["members"]:
+			dimensionName, _, count = memberCount.partition("=")
+			if dimensionName not in dimensionNames:
+				parser.error("argument --members: invalid choice: '{}' (choose from {})".format(dimensionName,
+					", ".join("'" + name + "'" for name in dimensionNames)))
+			if not count.isdigit():
+				parser.error("argument --members: invalid member count: '{}'".format(memberCount))
+			memberCounts[dimensionName] = int(count)
+		aMemberCounts = [memberCounts]
+	else:
+		aMemberCounts = [getMemberCounts(size, args["customs"]) for size in args["sizes"]]
+	previousResults = {}
+	if args["compare"]:
+		with open(args["compare"]) as previousFile:
+			previousResults = {previousResult["members"]: previousResult for previousResult in json.load(previousFile)["results"]}
+
+	importComparisonModules()
+	results = []
+	for memberCounts in aMemberCounts:
+		result = runBenchmark(memberCounts, args)
+		results.append(result)
+		printResult(result, previousResults.get(result["members"]))
+
+	outputFile = args["output"] or "Metadata_Benchmark_" + datetime.now().strftime("%Y%m%d_%H%M%S") + ".json"
+	with open(outputFile, "w") as benchmarkFile:
+		json.dump({"created": datetime.now().isoformat(timespec="seconds"), "python": sys.version.split()[0],
+			"platform": platform.platform(), "cpus": metadataCompare.getCpuCount(), "numpy": metadataCompare.getNumpy() is not None,
+			"settings": {key: args[key] for key in ["depth", "customs", "added", "removed", "changed", "reordered", "seed"]},
+			"results": results}, benchmarkFile, indent=2)
+	print("INFO: benchmark results are in the file: " + outputFile)
+
+if __name__ == "__main__":
+	process()
@@ -2,14 +2,12 @@
 Developer: Jithender Thota
 Date: 02-Mar-2023
 This script compares two metadata files and the differences identified between the two files are written to an excel file.
-Metadata files can have either .app or .txt extension.
-This script will give wierd results if both the files are not symmetric. Also the automation fails if the number of custom 
-dimensions are not same in both the files. This automation works only for applications with 4 custom dimensions. Below two lines
-must be modified if it has to work for an application with different number of custom dimensions.
-
-sEnti = 'Label,DefaultValueID,AllowAdjustments,IsICP,AllowChildrenAdjs,SecurityClassID,UserDefined1,UserDefined2,UserDefined3,HoldingCompany,EAPSecurityClassID,DefaultParent,Descriptions'
-sAcco = 'Label,AccountType,IsCalculated,IsConsolidated,IsICP,PlugAcct,Custom1TopMember,Custom2TopMember,Custom3TopMember,Custom4TopMember,NumDecimalPlaces,UsesLineItems,EnableCustom1Aggr,EnableCustom2Aggr,EnableCustom3Aggr,EnableCustom4Aggr,UserDefined1,UserDefined2,UserDefined3,XBRLTags,SecurityClass,ICPTopMember,EnableDataAudit,CalcAttribute,SubmissionGroup,DefaultParent,Descriptions'
-	
+Metadata files can have either .app or .txt extension, and can be compressed with gzip, bz2, xz or zip.
+This script will give wierd results if both the files are not symmetric. The properties of the members are named after
+the custom dimensions listed on the !CUSTOM_ORDER line of file1, the CustomNTopMember and EnableCustomNAggr columns of
+the accounts are built from it, so the script works for applications with any number of custom dimensions. Both files
+are expected to have the same custom dimensions, a file without the !CUSTOM_ORDER line is read with the 4 custom
+dimensions Custom1 to Custom4.
 
 This automation requires 3 parameters
 1) Two metadata files to be comapred
@@ -35,6 +33,35 @@ Command to run the script:
          This will compare the files ABTPLNQA_Metadata.app and ABTPROD_Metadata.app
     2.b) python Metadata_Compare.py -f1 <Metadata file1> -f2 <Metadata file2> -p <Path to these metadata files>  
          provide the metadata filenames and path without using the angular braces, also save the two metadata files in the same location
+         the files can also be compressed with gzip, bz2, xz or zip, for ex: -f1 QA_Metadata.app.gz -f2 PROD_Metadata.zip
+    2.c) python Metadata_Compare.py -f1 <Metadata file1> -f2 <Metadata file2> -p <Path to these metadata files> -m
+         compares the files in memory, no temporary files are written to the path, only the results file
+    2.d) python Metadata_Compare.py -f1 <Metadata file1> -f2 <Metadata file2> -p <Path to these metadata files> -w 4
+         compares the sections in memory on 4 processes, use at most the number of cores of the machine
+    2.e) python Metadata_Compare.py -f1 <Metadata file1> -f2 <Metadata file2> -p <Path to these metadata files> -m --cache-folder <Cache folder>
+         keeps the sections read from the files in the cache folder, the next run with an unchanged file loads them from
+         there instead of reading the file again, --cache-size limits the folder in MB
+    2.f) python Metadata_Compare.py -f1 <Baseline metadata file> -p <Path to these metadata files> -t <Metadata file2> <Metadata file3>
+         compares the baseline against every target file in one run, the results file has a value column per file
+    2.g) python Metadata_Compare.py -f1 <Metadata file1> -f2 <Metadata file2> -p <Path to these metadata files> -x --memory-budget 512
+         compares files which are bigger than the memory, at most about 512 MB of lines are held at a time and the rest is
+         spilled to --temp-folder
+    2.h) python Metadata_Compare.py -f1 <Metadata file1> -f2 <Metadata file2> -p <Path to these metadata files> --check
+         only checks whether the files differ, the sections which differ are printed and the exit code is 1 when any
+         section differs, 2 when a file cannot be read and 0 otherwise, nothing is written, for the CI gates
+    2.i) python Metadata_Compare.py -p <Path to the metadata files> --serve --port 8765
+         starts the comparison service, it serves only the files in the path and keeps the files it read in memory
+         python Metadata_Compare.py -f1 <Metadata file1> -f2 <Metadata file2> -p <Path to these metadata files> --submit --port 8765
+         submits the two files to the service, the rows are printed as JSON lines, or use --format xlsx for a results file
+    2.j) python Metadata_Compare.py -f1 <Metadata file1> -f2 <Metadata file2> -p <Path to these metadata files> --database <SQLite file>
+         writes the rows to a SQLite database instead of the excel file, every run is added to it, this can be combined
+         with the other modes when the differences are too many for a workbook
+    2.k) python Metadata_Compare.py -p <Path to the metadata files> --manifest <Manifest file> -w 4
+         compares every pair listed in the manifest, a CSV file with the columns file1, file2, path and output or a JSON
+         list with these keys, on 4 processes, a results file is written per pair and an index of them is the results file
+    2.l) python Metadata_Compare.py -f1 <Metadata file1> -f2 <Metadata file2> -p <Path to these metadata files> --state <State file>
+         compares the files in memory and saves the differences of every section to the state file, the next run with the
+         same state file compares again only the sections which changed since the last run
          
 3) python Metadata_Compare.py --help to get the help on this script. This will basically gives the usage of the script
 
@@ -46,44 +73,108 @@ Only the important libraries usage is provided here
 openpyxl: Used to write the results to an excel file. Results are actually written to a csv file, styling cannot be done
 in a csv file. So the results are copied from CSV file to an excel file and then styled using this library.
 
-difflib: compares two files and generates a single file with all the differences, this library is used for optimization purpose.
-Before using this library automation was taking some 30 to 50 mins depending on the size of the metadata files. After using this
-library it completes in seconds.
+collections: the lines of the two files are counted per section and only the lines whose count differs are compared, this is
+used for optimization purpose. Before this prefilter automation was taking some 30 to 50 mins depending on the size of the
+metadata files. With it the comparison completes in seconds and does not depend on the order of the members in the exports.
 
 Algorithm:
 =========
 1) Directories are created to store temporary files created during the script execution.
 2) Some metadata files has spaces and some may not have spaces. So spaces are removed first in the metadata files
 3) Metadata files are then split into small metadata files by the sections in the metadata and then stored in their respective folders
-4) Then these small metadata files are compared using the diff library and then results are written to the CSV file
+4) Then these small metadata files are compared line by line, regardless of the order, and then results are written to the CSV file
 5) Then the results are copied to an xls file to allow some formatting
 6) All the temporary files are deleted
 
+With -m the files are compared in memory:
+1) Both files are read once, the spaces are removed from every line while it is read and the lines are split by section
+2) The lines of every section are counted in both files and only the lines whose count differs are compared
+3) The rows are written to the excel file while the sections are compared, no temporary files are created
+
+With -w and more than one worker the files are compared in memory as with -m, the sections are compared on a pool of
+processes, the biggest sections first, and their rows are written in the order of the sections in file1, so the results
+file is the same as that of a run with one worker. When the machine has more than one CPU a file bigger than 4 MB is
+read in chunks of 4 MB on the workers, each worker trims the lines of its chunk and splits them by section.
+
+With --cache-folder the sections read from a file by the in-memory modes are saved to the cache folder as a snapshot named
+by the sha256 of the file, a later run with the same file loads the snapshot instead of reading and trimming the file.
+The least recently used snapshots are deleted once the folder is bigger than --cache-size.
+
+With -t the baseline is read and every section of it is indexed once, each target is compared against that index in
+memory. The rows of all the targets are merged by Dimension, Member Name, Property and the value in the baseline, a
+target without a row for it has the value of the baseline.
+
+With -x the files are compared with an external sort-merge:
+1) Each file is read as a stream, every line is tagged with its section and a group key, the member label, the child of
+   a hierarchy line or the key of a setting, and the lines are sorted and spilled as runs to the temporary folder each
+   time --memory-budget is reached
+2) The runs of the two files are merged, so the lines of one group in both files come together and only one group is
+   held in memory at a time, each group is compared like a section
+3) The rows are sorted back to the order of the in-memory comparison and written to the excel file, the runs are deleted
+
+With --check each file is read once, its lines are trimmed as in the comparison and every section is reduced to its
+number of lines and the sum of the blake2b of its lines, kept while the file is read. The sections whose fingerprints
+differ are printed, no rows are produced.
+
+With --serve the script keeps running as a service on --port. Each job posted by --submit is compared in memory on a
+pool of threads, the sections read from the last --service-cache files and the indexes of their sections are kept, so
+a baseline which is compared again and again is read once. The rows are streamed back while they are found.
+
+With --database the rows are inserted in batches into the differences table of the SQLite database, one row per target
+file with the value in file1 and in the target, and the run is added to the runs table. The indexes on dimension, member
+and property are created after the rows are in.
+
+In every mode a file compressed with gzip, bz2, xz or zip is recognised by its first bytes and decompressed while it is
+read, nothing is extracted to the path. A zip file is read from its first .app or .txt member.
+
+With --manifest the pairs of the manifest are compared in memory on a pool of --workers processes, the pairs with the
+same file1 go to one process as one task so that file1 is read once for all of them. An entry which is not valid or a
+pair which fails is marked as failed in the index and the other pairs go on.
+
+With --state the files are compared in memory and every section of both files gets a fingerprint, a blake2b of its
+trimmed lines. The sections whose fingerprints are the same as in the state file take their rows from it, the others are
+compared, and the fingerprints and rows of all the sections are saved back to the state file with the sections which
+changed since the last run in the run profile.
+
 
 '''
 
 
-import openpyxl
-from openpyxl.styles import Font, Color, PatternFill
-from openpyxl import Workbook
-import difflib
+'''
+openpyxl, numpy, concurrent.futures, the profilers and the modules used only by the results, the snapshot cache, the
+state file, --report-reorder and --external, like pickle, zlib, heapq, bisect and shutil, are imported in the functions
+which use them, so the --check mode starts without loading them.
+'''
+import collections
+import contextlib
+import functools
+import itertools
 import os
 import sys
 from datetime import datetime
 import csv
 import argparse
 import re
-from pathlib import Path
-import shutil
 import textwrap
+import threading
 import time
 
 now = datetime.now()
 
+@functools.lru_cache(maxsize=None)
+def getNumpy():
+	try:
+		import numpy
+	except ImportError:
+		return None
+	return numpy
+
 def getFontStyle():
+    from openpyxl.styles import Font
     return Font(size=14,bold=True)
 
 def getBackGroundColor():
+        from openpyxl.styles import PatternFill
         return PatternFill(patternType='solid', fgColor='92D2E2')
         
 def getCurrentTime():
@@ -100,38 +191,233 @@ def printWarningLines(textToPrint):
 def printLine(textToPrint):
     print("INFO: {}: {}" .format(getCurrentTime(), textToPrint))
 
+'''
+Instrumentation of a run. Every stage of the comparison is timed with runProfile.stage, the time spent in a nested
+stage is not counted in the outer stage, for ex: the rows are compared while the results file is written, so the
+report stage has only the time of writing the rows. A stage without a name only pauses the outer stage, it is used
+around work which is recorded with addStage, like the sections compared by the workers. The stages and sections also
+count the records they processed. The running stages are kept per thread and the totals are updated under a lock, so
+the jobs of --serve and --manifest can be timed together.
+At the end of the run the profile is written as JSON next to the results file and a summary table is printed.
+'''
+def getPeakMemory():
+	try:
+		import resource
+		peakMemory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		return peakMemory if sys.platform == "darwin" else peakMemory * 1024
+	except ImportError:
+		pass
+	try:
+		import ctypes
+		class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+			_fields_ = [("cb", ctypes.c_ulong), ("PageFaultCount", ctypes.c_ulong), ("PeakWorkingSetSize", ctypes.c_size_t),
+				("WorkingSetSize", ctypes.c_size_t), ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+				("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+				("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+		counters = PROCESS_MEMORY_COUNTERS()
+		counters.cb = ctypes.sizeof(counters)
+		ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb)
+		return counters.PeakWorkingSetSize
+	except (ImportError, AttributeError, OSError):
+		return None
+
+class RunProfile:
+
+	def __init__(self):
+		self.startTime = time.perf_counter()
+		self.stages = {}
+		self.sections = {}
+		self.threadStages = threading.local()
+		self.lock = threading.Lock()
+
+	@contextlib.contextmanager
+	def stage(self, stageName=None):
+		runningStages = self.threadStages.__dict__.setdefault("runningStages", [])
+		now = time.perf_counter()
+		if runningStages:
+			outerStage = runningStages[-1]
+			outerStage[1] = outerStage[1] + now - outerStage[2]
+		runningStage = [stageName, 0.0, now]
+		runningStages.append(runningStage)
+		try:
+			yield
+		finally:
+			now = time.perf_counter()
+			runningStages.pop()
+			if stageName is not None:
+				self.addStage(stageName, runningStage[1] + now - runningStage[2])
+			if runningStages:
+				runningStages[-1][2] = now
+
+	def addStage(self, stageName, seconds=0.0, records=0):
+		with self.lock:
+			stageProfile = self.stages.setdefault(stageName, {"seconds": 0.0, "records": 0})
+			stageProfile["seconds"] = stageProfile["seconds"] + seconds
+			stageProfile["records"] = stageProfile["records"] + records
+
+	def addSection(self, sectionName, **values):
+		with self.lock:
+			sectionProfile = self.sections.setdefault(sectionName, {})
+			for key, value in values.items():
+				sectionProfile[key] = sectionProfile.get(key, 0) + value
+
+	def getProfile(self):
+		peakMemory = getPeakMemory()
+		with self.lock:
+			stageProfiles = {stageName: dict(stageProfile) for stageName, stageProfile in self.stages.items()}
+			sectionProfiles = {sectionName: dict(sectionProfile) for sectionName, sectionProfile in self.sections.items()}
+		stages = {}
+		for stageName, stageProfile in stageProfiles.items():
+			stages[stageName] = {"seconds": round(stageProfile["seconds"], 4), "records": stageProfile["records"],
+				"records_per_sec": round(stageProfile["records"] / stageProfile["seconds"]) if stageProfile["seconds"] else None}
+		sections = {}
+		for sectionName, sectionProfile in sectionProfiles.items():
+			sections[sectionName] = {key: round(value, 4) if isinstance(value, float) else value for key, value in sectionProfile.items()}
+		return {"total_seconds": round(time.perf_counter() - self.startTime, 4),
+			"peak_rss_mb": round(peakMemory / 1024 / 1024, 1) if peakMemory else None, "stages": stages, "sections": sections}
+
+	def writeProfile(self, profilePath, runDetails):
+		import json
+		profile = dict(runDetails)
+		profile.update(self.getProfile())
+		with open(profilePath, "w") as profileFile:
+			json.dump(profile, profileFile, indent=2)
+		return profile
+
+	def printSummary(self, profile, slowestSections=10):
+		print(20 * "*")
+		print("{:<28}{:>10}{:>12}{:>14}".format("Stage", "secs", "records", "records/sec"))
+		for stageName, stageProfile in profile["stages"].items():
+			print("{:<28}{:>10}{:>12}{:>14}".format(stageName, stageProfile["seconds"], stageProfile["records"], str(stageProfile["records_per_sec"])))
+		sections = sorted(profile["sections"].items(), key=lambda section: section[1].get("diff_seconds", 0) + section[1].get("compare_seconds", 0), reverse=True)
+		if sections:
+			print("{:<28}{:>10}{:>12}{:>14}".format("Section", "secs", "lines", "rows"))
+			for sectionName, sectionProfile in sections[:slowestSections]:
+				print("{:<28}{:>10}{:>12}{:>14}".format(processBlock(sectionName)[:27], round(sectionProfile.get("diff_seconds", 0) + sectionProfile.get("compare_seconds", 0), 4),
+					sectionProfile.get("lines", 0), sectionProfile.get("rows", 0)))
+		print("{:<28}{:>10}".format("Total", profile["total_seconds"]))
+		if profile["peak_rss_mb"] is not None:
+			print("{:<28}{:>10}".format("Peak memory (MB)", profile["peak_rss_mb"]))
+
+runProfile = RunProfile()
+
 def createResultsFile(differencesfilePath):
     
     global excelFilePath
     printLines("creating the Results file")
-    excelFilePath = differencesfilePath.split(".")[0] + ".xlsx"
+    excelFilePath = getResultsFilePath()
     #print("excelFilePath: " + excelFilePath)
-    book =  Workbook()
-    book.save(excelFilePath)
-    printLine("completed ....")
-    writeToResultsFile()
+    writeResults(excelFilePath, readResultsCSVFile(differencesfilePath), "disk")
  
+def readResultsCSVFile(differencesfilePath):
+    with open(differencesfilePath, encoding="cp1252", newline="") as resultsCSVFile:
+        for aLine in csv.reader(resultsCSVFile):
+            yield aLine
 
-        
-def writeToResultsFile():
+'''
+The results go to the workbook, or to the SQLite database given with --database.
+'''
+resultsDatabasePath = None
+
+def getResultsFilePath():
+    if resultsDatabasePath is not None:
+        return resultsDatabasePath
+    return differencesfilePath.split(".")[0] + ".xlsx"
+
+def writeResults(resultsFilePath, rows, mode):
+    if resultsDatabasePath is not None:
+        writeToResultsDatabase(resultsFilePath, rows, mode)
+    else:
+        writeToResultsFile(resultsFilePath, rows)
+
+'''
+Results are streamed to a write only workbook, so the rows are written as they come from the comparison and are
+never held in memory. Only the header row is styled. Excel allows 1048576 rows in a sheet, when a sheet is full
+the rows continue on a new sheet which starts with the same header.
+'''
+maxRowsPerSheet = 1048576
+
+def getHeaderCells(ws, header):
+    from openpyxl.cell import WriteOnlyCell
+    headerCells = []
+    for item in header:
+        cell = WriteOnlyCell(ws, value=item)
+        cell.font = getFontStyle()
+        cell.fill = getBackGroundColor()
+        headerCells.append(cell)
+    return headerCells
+
+def writeToResultsFile(excelFilePath, rows):
+    from openpyxl import Workbook
     printLines("updating the results file with differences")
-    wb = openpyxl.load_workbook(filename=excelFilePath)
-    ws = wb['Sheet']
-    rowNumber = 0
-      
-    with open(differencesfilePath, encoding="cp1252") as resultsCSVFile:
-        for line in resultsCSVFile:
-            #print(line)
+    with runProfile.stage("report"):
+        wb = Workbook(write_only=True)
+        rows = iter(rows)
+        header = next(rows)
+        ws = wb.create_sheet("Sheet")
+        ws.append(getHeaderCells(ws, header))
+        rowNumber = 1
+        numberOfRows = 0
+        for aLine in rows:
+            if rowNumber == maxRowsPerSheet:
+                ws = wb.create_sheet("Sheet" + str(len(wb.worksheets) + 1))
+                ws.append(getHeaderCells(ws, header))
+                rowNumber = 1
+            ws.append(aLine)
             rowNumber = rowNumber + 1
-            aLine = line.split(",")
-            for columnNumber, item in enumerate(aLine):
-                ws.cell(row = rowNumber, column=columnNumber+1).value = item
-                if rowNumber == 1:
-                    cellNumber = ws.cell(row = rowNumber, column=columnNumber+1)
-                    cellNumber.font = getFontStyle()
-                    cellNumber.fill = getBackGroundColor()
-
-    wb.save(excelFilePath)
+            numberOfRows = numberOfRows + 1
+
+        wb.save(excelFilePath)
+    runProfile.addStage("report", records=numberOfRows)
+    printLine("completed ....")
+    return numberOfRows
+
+'''
+With --database the rows are inserted into a SQLite database instead, which can be queried and filtered when the
+differences are too many for a workbook. Every run adds a row to the runs table with the files, the mode and the number
+of rows, and its differences to the differences table, one row per target file with the value in file1 and in the
+target. The rows are inserted in batches of resultsDatabaseBatchSize, one transaction per batch, and the indexes on
+dimension, member and property are created after the first run's rows are in. In a comparison with --targets a target
+with the same value as file1 has no difference and is not inserted.
+'''
+resultsDatabaseBatchSize = 10000
+
+def writeToResultsDatabase(databasePath, rows, mode):
+    import sqlite3
+    printLines("updating the results database with differences")
+    with runProfile.stage("report"):
+        connection = sqlite3.connect(databasePath)
+        try:
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS runs (run_id INTEGER PRIMARY KEY, started TEXT, finished TEXT, file1 TEXT,
+                    targets TEXT, mode TEXT, rows INTEGER);
+                CREATE TABLE IF NOT EXISTS differences (run_id INTEGER REFERENCES runs (run_id), dimension TEXT,
+                    member TEXT, property TEXT, file2 TEXT, file1_value TEXT, file2_value TEXT);""")
+            rows = iter(rows)
+            header = next(rows)
+            targets = header[4:]
+            with connection:
+                runId = connection.execute("INSERT INTO runs (started, file1, targets, mode) VALUES (?, ?, ?, ?)",
+                    (datetime.now().isoformat(timespec="seconds"), header[3], ";".join(targets), mode)).lastrowid
+            numberOfRows = 0
+            for batch in iter(lambda: list(itertools.islice(rows, resultsDatabaseBatchSize)), []):
+                differences = []
+                for aLine in batch:
+                    for targetNumber, target in enumerate(targets):
+                        value2 = aLine[4 + targetNumber] if len(aLine) > 4 + targetNumber else None
+                        if len(targets) > 1 and value2 == aLine[3]:
+                            continue
+                        differences.append((runId, aLine[0], aLine[1], aLine[2], target, aLine[3], value2))
+                with connection:
+                    connection.executemany("INSERT INTO differences VALUES (?, ?, ?, ?, ?, ?, ?)", differences)
+                numberOfRows = numberOfRows + len(batch)
+            with connection:
+                connection.execute("UPDATE runs SET finished = ?, rows = ? WHERE run_id = ?", (datetime.now().isoformat(timespec="seconds"), numberOfRows, runId))
+                for column in ("run_id", "dimension", "member", "property"):
+                    connection.execute("CREATE INDEX IF NOT EXISTS differences_{0} ON differences ({0})".format(column))
+        finally:
+            connection.close()
+    runProfile.addStage("report", records=numberOfRows)
     printLine("completed ....")
     
 '''
@@ -160,11 +446,51 @@ def createTempFolders(filePath, metadataFile1, metadataFile2):
 		os.mkdir(getFullPath(metadataFilesFolder,"differences"))
 	return metadataFilesFolder
 
+'''
+Metadata files compressed with gzip, bz2, xz or zip are recognised by their first bytes, whatever their extension, and
+are decompressed while they are read, so nothing is extracted to disk and only the compressed size is read from the
+share. A zip file is read from its first .app or .txt member.
+'''
+def getCompression(metadataFilePath):
+	with open(metadataFilePath, "rb") as metadataFile:
+		magicBytes = metadataFile.read(6)
+	if magicBytes[:2] == b"\x1f\x8b":
+		return "gzip"
+	if magicBytes[:3] == b"BZh":
+		return "bz2"
+	if magicBytes == b"\xfd7zXZ\x00":
+		return "xz"
+	if magicBytes[:4] == b"PK\x03\x04":
+		return "zip"
+	return None
+
+def openMetadataFile(metadataFilePath):
+	compression = getCompression(metadataFilePath)
+	if compression == "gzip":
+		import gzip
+		return gzip.open(metadataFilePath, "rt", encoding="cp1252")
+	if compression == "bz2":
+		import bz2
+		return bz2.open(metadataFilePath, "rt", encoding="cp1252")
+	if compression == "xz":
+		import lzma
+		return lzma.open(metadataFilePath, "rt", encoding="cp1252")
+	if compression == "zip":
+		import io
+		import zipfile
+		with zipfile.ZipFile(metadataFilePath) as zipFile:
+			memberNames = [member.filename for member in zipFile.infolist() if not member.is_dir()]
+			metadataNames = [memberName for memberName in memberNames if os.path.splitext(memberName)[1].lower() in (".app", ".txt")]
+			if not memberNames:
+				raise Exception("Terminating the program as the zip file " + metadataFilePath + " is empty")
+			return io.TextIOWrapper(zipFile.open((metadataNames or memberNames)[0]), encoding="cp1252")
+	return open(metadataFilePath, encoding="cp1252")
+
 def numberOfCustomDimensions(filePath,metadataFiles):
 	anumOfCustDimensions = []
 	printLines("Validating the number of custom dimensions in the given metadata files")
 	for file in metadataFiles:
-		with open(getFullPath(filePath,file), 'r', encoding="cp1252", newline="") as metadataFile:
+		with openMetadataFile(getFullPath(filePath,file)) as metadataFile:
 			for line in metadataFile:
 				if "!CUSTOM_ORDER" in line:
 					customDimensions = line.split("=")[1]
@@ -183,31 +509,119 @@ def numberOfCustomDimensions(filePath,metadataFiles):
 '''
 Some metadata files have spaces and few metadata files might not have spaces. 
 So removing the spaces in the both the metadata files before running the comparison
-
+A printable ascii line has no whitespace but spaces, when none of them is next to a ";" the line is only stripped
 '''
+def trimLine(line):
+	line = line.strip()
+	if line.isascii() and line.isprintable() and "; " not in line and " ;" not in line:
+		return line
+	return ";".join(map(str.strip, line.split(";")))
+
 def trimMetadataFiles(filePath, metadataFiles):
 	for file in metadataFiles:
-		source_file = open(getFullPath(filePath,file), encoding="cp1252")
-		destination_file = open(getFullPath(filePath,file.split(".")[0] + "_v1.txt"), "w", encoding="cp1252")
-		for line in source_file:
-			line_split = line.split(";")
-			new_line = ""
-			for i in range(0,len(line_split)):
-				spaces_removed_line_split = line_split[i].strip()
-				if i==0:
-					new_line = spaces_removed_line_split
-				else:
-					new_line = new_line + ";" + spaces_removed_line_split
-			destination_file.write(new_line + "\n")
-		source_file.close()
-		destination_file.close()
+		with runProfile.stage("trim"):
+			source_file = openMetadataFile(getFullPath(filePath,file))
+			destination_file = open(getFullPath(filePath,file.split(".")[0] + "_v1.txt"), "w", encoding="cp1252")
+			numberOfLines = 0
+			for line in source_file:
+				destination_file.write(trimLine(line) + "\n")
+				numberOfLines = numberOfLines + 1
+			source_file.close()
+			destination_file.close()
+		runProfile.addStage("trim", records=numberOfLines)
+
+dimensionArray = ['!APPLICATION_SETTINGS', '!CURRENCIES', '!MEMBERS','!HIERARCHIES', '!CONSOLIDATION_METHODS']
+nonDimensionArray = ['!FILE_FORMAT', '!VERSION', '!CUSTOM_ORDER', '!LABEL']
+
+def getSectionName(line):
+	aline = line.split("=")
+	if aline[0] in nonDimensionArray or line[0] != "!" or aline[0].strip().upper() not in dimensionArray:
+		return None
+	if len(aline) == 1:
+		return aline[0][1:].strip().upper()
+	return aline[1].strip() + aline[0][1]
+
+'''
+Parser of the metadata files. A metadata file is read once, every line is trimmed and split a single time and turned
+into a typed record, all the later stages work on these records instead of splitting the lines again.
+The records of a section are classified by the number of fields separated by ";"
+1 field   - Setting, Key=Value
+2 fields  - HierarchyEdge without aggregation weight, parent;child
+3 fields  - HierarchyEdge with aggregation weight, parent;child;aggrweight
+4 or more - Member and the tuple of its properties, the label being the first property
+Section headers are returned as SectionHeader and the !FILE_FORMAT, !VERSION, !CUSTOM_ORDER and !LABEL lines as Directive.
+'''
+class SectionHeader:
+	__slots__ = ("name",)
+
+	def __init__(self, name):
+		self.name = name
+
+class Directive:
+	__slots__ = ("key", "value")
+
+	def __init__(self, key, value):
+		self.key = key
+		self.value = value
+
+class Setting:
+	__slots__ = ("line", "key", "value")
+
+	def __init__(self, line, key, value):
+		self.line = line
+		self.key = key
+		self.value = value
+
+class HierarchyEdge:
+	__slots__ = ("line", "parent", "child", "weight")
+
+	def __init__(self, line, parent, child, weight):
+		self.line = line
+		self.parent = parent
+		self.child = child
+		self.weight = weight
+
+class Member:
+	__slots__ = ("line", "label", "properties")
+
+	def __init__(self, line, properties):
+		self.line = line
+		self.label = properties[0]
+		self.properties = properties
+
+def parseLine(line):
+	fields = [item.strip() for item in line.split(";")]
+	line = ";".join(fields)
+	if line == "":
+		return None
+	if line[0] == "!":
+		sectionName = getSectionName(line)
+		if sectionName is not None:
+			return SectionHeader(sectionName)
+		key = line.split("=")[0]
+		if key in nonDimensionArray:
+			return Directive(key, line[len(key)+1:])
+	if len(fields) == 1:
+		aline = line.split("=")
+		return Setting(line, aline[0], aline[1] if len(aline) > 1 else "")
+	if len(fields) == 2:
+		return HierarchyEdge(line, fields[0], fields[1], None)
+	if len(fields) == 3:
+		return HierarchyEdge(line, fields[0], fields[1], fields[2])
+	return Member(line, tuple(fields))
+
+def parseMetadataFile(metadataFilePath):
+	with openMetadataFile(metadataFilePath) as metadataFile:
+		for line in metadataFile:
+			record = parseLine(line)
+			if record is not None:
+				yield record
 
 '''
 For quick comparision Metadata is split into different fies based on members and hierarchy, for ex: Account dimension has two sections
 in the metadata file, Members section and Hierarchy section. So account dimension is split into two different files, one file containing
 only members section and the other file containing Hierarchy section.
 '''
-		
 def splitFile(filePath, metadataFiles):
 	aDimensionsInBothFiles = []    
 	for file in metadataFiles:
@@ -217,27 +631,16 @@ def splitFile(filePath, metadataFiles):
 		trimmedFile = getFullPath(filePath, file.split(".")[0]) + "_v1.txt"
 		destinationPath = getFullPath(filePath,"Dimension_files")
 		destinationPath = getFullPath(destinationPath,file.split(".")[0])
-		with open(trimmedFile, encoding="cp1252") as file:
-			dimensionArray = ['!APPLICATION_SETTINGS', '!CURRENCIES', '!MEMBERS','!HIERARCHIES', '!CONSOLIDATION_METHODS']
-			nonDimensionArray = ['!FILE_FORMAT', '!VERSION', '!CUSTOM_ORDER', '!LABEL']
-			fileName = ""
-			for line in file:
-				if not line.strip() == '':
-					aline = line.split("=")
-					if aline[0] not in nonDimensionArray:
-						if line[0] == "!" and (aline[0].strip().upper() in dimensionArray):
-							#processOrder = processOrder + 1
-							if len(aline) == 1:
-								#fileName = str(processOrder) + "." + aline[0][1:].strip().upper()
-								fileName = aline[0][1:].strip().upper()
-							else:
-								#fileName = str(processOrder) + "." + aline[1].strip() + aline[0][1]
-								fileName = aline[1].strip() + aline[0][1]
-							aDimensionsInEachFile.append(fileName)
-							output_file = open(os.path.join(destinationPath, fileName +".txt"), "w", encoding="cp1252")
-													
-						else:
-							output_file.write(line)
+		with runProfile.stage("split"):
+			numberOfRecords = 0
+			for record in parseMetadataFile(trimmedFile):
+				if type(record) is SectionHeader:
+					aDimensionsInEachFile.append(record.name)
+					output_file = open(os.path.join(destinationPath, record.name +".txt"), "w", encoding="cp1252")
+				elif type(record) is not Directive:
+					output_file.write(record.line + "\n")
+					numberOfRecords = numberOfRecords + 1
+		runProfile.addStage("split", records=numberOfRecords)
 		aDimensionsInBothFiles.append(aDimensionsInEachFile)
 		printLine("Completed ....")
 		#print("aDimensionsInEachFile")
@@ -247,8 +650,8 @@ def splitFile(filePath, metadataFiles):
 	return aDimensionsInBothFiles
 		
 '''
-difflib library is used to identify the differences in two files, differences identified are written to the file diff.txt.
-This diff.txt has differences from both the metadata files. These differences are split into two different files.
+The lines of a section which are not in the other file are identified with findLineDifferences, the differences from
+each metadata file are written to their own file and then compared.
 '''
 def processBlock(metadataFile):
 	anonStandardDimension = ["APPLICATION_SETTINGS", "CURRENCIES", "CONSOLIDATION_METHODS"]
@@ -261,34 +664,36 @@ def processBlock(metadataFile):
 		processingDimension = metadataFile.split(".")[0][:-1] + " Members"
 	return processingDimension
 	
-def findDifferences(differences_FilePath, metadataFolder1, metadataFolder2, metadataFile):
+def findDifferences(differences_FilePath, metadataFolder1, metadataFolder2, metadataFile, reportReorder=False):
 	printLines("Finding discrepancies in " + processBlock(metadataFile))
 	fileFromFolder1 = getFullPath(os.path.join(differences_FilePath,metadataFolder1), metadataFile)
 	fileFromFolder2 = getFullPath(os.path.join(differences_FilePath,metadataFolder2), metadataFile)
-	with open(fileFromFolder1, "r", encoding="cp1252") as f1:
-		with open(fileFromFolder2, "r", encoding="cp1252") as f2:
-			diff = difflib.unified_diff(f1.readlines(), f2.readlines(),fromfile='f1', tofile='f2',)
-			with open(getFullPath(differences_FilePath,"differences/diff.txt"),"w", encoding="cp1252") as diff_file:
-				for line in diff:
-					diff_file.write(line)
+	startTime = time.perf_counter()
+	with runProfile.stage("diff"):
+		with open(fileFromFolder1, "r", encoding="cp1252") as f1:
+			with open(fileFromFolder2, "r", encoding="cp1252") as f2:
+				lines1 = f1.read().splitlines()
+				lines2 = f2.read().splitlines()
+				differences1, differences2 = findLineDifferences(indexBaselineSection(lines1), lines2)
+	runProfile.addStage("diff", records=len(lines1) + len(lines2))
+	runProfile.addSection(metadataFile.split(".")[0], lines=len(lines1) + len(lines2), diff_seconds=time.perf_counter() - startTime)
 	printLine("Completed ....")
-	splitDifferences(differences_FilePath, metadataFile.split(".")[0])
+	splitDifferences(differences_FilePath, metadataFile.split(".")[0], differences1, differences2, (lines1, lines2))
+	if reportReorder:
+		with open(differencesfilePath, "a", encoding="cp1252", newline="") as outputCSVFile:
+			CSVWriter = csv.writer(outputCSVFile)
+			CSVWriter.writerows(compareSectionOrder(metadataFile.split(".")[0], lines1, lines2))
 		
-def splitDifferences(filePath, dimension):
-	file1 = open(getFullPath(filePath,"differences/file1.txt"),"w", encoding="cp1252")
-	file2 = open(getFullPath(filePath,"differences/file2.txt"),"w", encoding="cp1252")
-	
-	with open(getFullPath(filePath,"differences/diff.txt"), "r", encoding="cp1252") as difference:
-		for line in difference:
-			if line[0] == "-" and len(line)>2 and line[1] != "-":
-				file1.write(line[1:])
-			if line[0] == "+" and len(line)>2 and line[1] != "+":
-				file2.write(line[1:])
-	file1.close()
-	file2.close()
+def splitDifferences(filePath, dimension, differences1, differences2, sectionLines=None):
+	with open(getFullPath(filePath,"differences/file1.txt"),"w", encoding="cp1252") as file1:
+		for line in differences1:
+			file1.write(line + "\n")
+	with open(getFullPath(filePath,"differences/file2.txt"),"w", encoding="cp1252") as file2:
+		for line in differences2:
+			file2.write(line + "\n")
 	#print(listOfCustDimensions)
-	if not os.stat(getFullPath(filePath,"differences/file1.txt")).st_size == 0 or not os.stat(getFullPath(filePath,"differences/file2.txt")).st_size == 0:
-		compare_files(getFullPath(filePath, "differences"), dimension)
+	if differences1 or differences2:
+		compare_files(getFullPath(filePath, "differences"), dimension, sectionLines)
 		
 '''
 This is function which actually compares two metadata files and writes the results to the results file
@@ -301,139 +706,1411 @@ def getMetadataSection(dimension):
         metadataProperty = "Member"
     return metadataProperty
 
-def compare_files(diffFilePath, dimension):
-	sCurr = 'Label,Scale,TranslationOperator,DisplayInICT,Descriptions'
-	sScen = 'Label,DefaultFreq,DefaultView,ZeroViewForNonadj,ZeroViewForAdj,ConsolidateYTD,UserDefined1,UserDefined2,UserDefined3,SupportsProcessManagement,SecurityClass,MaximumReviewLevel,UsesLineItems,EnableDataAudit,DefFreqForICTrans,PhasedSubStartYear,DefaultParent,Descriptions'
-	sEnti = 'Label,DefaultValueID,AllowAdjustments,IsICP,AllowChildrenAdjs,SecurityClassID,UserDefined1,UserDefined2,UserDefined3,HoldingCompany,EAPSecurityClassID,DefaultParent,Descriptions'
-	#sAcco = 'Label, AccountType, IsCalculated, IsConsolidated, IsICP, PlugAcct, NumDecimalPlaces, usesLineItems, UserDefined1,UserDefined2, USerDefined3, XBRLTags, SecurityClass, ICPTopMember, EnableDataAudit, CalcAttribute, SubmissionGroup, DefaultParent, Descriptions'
-	sAcco = 'Label,AccountType,IsCalculated,IsConsolidated,IsICP,PlugAcct,Custom1TopMember,Custom2TopMember,Custom3TopMember,Custom4TopMember,NumDecimalPlaces,UsesLineItems,EnableCustom1Aggr,EnableCustom2Aggr,EnableCustom3Aggr,EnableCustom4Aggr,UserDefined1,UserDefined2,UserDefined3,XBRLTags,SecurityClass,ICPTopMember,EnableDataAudit,CalcAttribute,SubmissionGroup,DefaultParent,Descriptions'
-	
-	sCust = 'Label,IsCalculated,SwitchSignForFlow,SwitchTypeForFlow,UserDefined1,UserDefined2,UserDefined3,SecurityClass,SubmissionGroup,DefaultParent,Descriptions'
-	sCons = 'Label,UsedByCalcRoutine,IsHoldingMethod,ToPercentControlComp,ToPercentControl,percentConsol,Control,Descriptions'
-	aCurr = sCurr.split(",")
-	aScen = sScen.split(",")
-	aEnti = sEnti.split(",")
-	aAcco = sAcco.split(",")
-	aCust = sCust.split(",")
-	aCons = sCons.split(",")
-	aMemLength = [len(aCurr), len(aScen), len(aEnti),len(aAcco),len(aCust),len(aCons)]
-	aMemArray = [aCurr,aScen, aEnti,aAcco,aCust,aCons]
-	file1 = getFullPath(diffFilePath, "file1.txt")
-	file2 = getFullPath(diffFilePath, "file2.txt")
-	
-	with open(differencesfilePath, "a", encoding="cp1252", newline="") as outputCSVFile:
-		CSVWriter = csv.writer(outputCSVFile)
-		for f in [file1, file2]:
-			processfile12 = False
-			processfile21 = False
-			if f == file1:
-				s_file = file1
-				d_file = file2
-				processfile12 = True
+'''
+Property names of the member sections. The member lines do not carry the property names, so the property array is
+picked by the dimension of the section and checked against the number of fields in the member line, when they do not
+agree the property array with that number of fields is used. The account properties depend on the number of custom
+dimensions, which are read from the !CUSTOM_ORDER line of file1, applications without that line have 4 custom dimensions.
+'''
+sCurr = 'Label,Scale,TranslationOperator,DisplayInICT,Descriptions'
+sScen = 'Label,DefaultFreq,DefaultView,ZeroViewForNonadj,ZeroViewForAdj,ConsolidateYTD,UserDefined1,UserDefined2,UserDefined3,SupportsProcessManagement,SecurityClass,MaximumReviewLevel,UsesLineItems,EnableDataAudit,DefFreqForICTrans,PhasedSubStartYear,DefaultParent,Descriptions'
+sEnti = 'Label,DefaultValueID,AllowAdjustments,IsICP,AllowChildrenAdjs,SecurityClassID,UserDefined1,UserDefined2,UserDefined3,HoldingCompany,EAPSecurityClassID,DefaultParent,Descriptions'
+sAcco = 'Label,AccountType,IsCalculated,IsConsolidated,IsICP,PlugAcct,{CustomTopMembers},NumDecimalPlaces,UsesLineItems,{EnableCustomAggrs},UserDefined1,UserDefined2,UserDefined3,XBRLTags,SecurityClass,ICPTopMember,EnableDataAudit,CalcAttribute,SubmissionGroup,DefaultParent,Descriptions'
+sCust = 'Label,IsCalculated,SwitchSignForFlow,SwitchTypeForFlow,UserDefined1,UserDefined2,UserDefined3,SecurityClass,SubmissionGroup,DefaultParent,Descriptions'
+sCons = 'Label,UsedByCalcRoutine,IsHoldingMethod,ToPercentControlComp,ToPercentControl,percentConsol,Control,Descriptions'
+defaultCustomOrder = ["Custom1", "Custom2", "Custom3", "Custom4"]
+
+def getCustomOrder(metadataFilePath):
+	for record in parseMetadataFile(metadataFilePath):
+		if type(record) is Directive and record.key == "!CUSTOM_ORDER":
+			return record.value.split(";")
+		if type(record) is SectionHeader:
+			break
+	return defaultCustomOrder
+
+@functools.lru_cache(maxsize=None)
+def getPropertyArrays(customOrder):
+	customNumbers = [str(customNumber) for customNumber in range(1, len(customOrder) + 1)]
+	sAccount = sAcco.format(CustomTopMembers=",".join("Custom" + customNumber + "TopMember" for customNumber in customNumbers),
+		EnableCustomAggrs=",".join("EnableCustom" + customNumber + "Aggr" for customNumber in customNumbers))
+	return {"CURRENCIES": sCurr.split(","), "SCENARIO": sScen.split(","), "ENTITY": sEnti.split(","),
+		"ACCOUNT": sAccount.split(","), "CUSTOM": sCust.split(","), "CONSOLIDATION_METHODS": sCons.split(",")}
+
+def getPropertyArray(dimension, numberOfFields, customOrder=None):
+	aPropertyArrays = getPropertyArrays(tuple(customOrder or defaultCustomOrder))
+	dimensionName = dimension[:len(dimension)-1].upper()
+	if dimension in aPropertyArrays:
+		aPropertyArray = aPropertyArrays[dimension]
+	elif dimensionName in aPropertyArrays:
+		aPropertyArray = aPropertyArrays[dimensionName]
+	elif dimensionName in [customName.upper() for customName in (customOrder or defaultCustomOrder)]:
+		aPropertyArray = aPropertyArrays["CUSTOM"]
+	else:
+		aPropertyArray = None
+	if aPropertyArray is not None and len(aPropertyArray) == numberOfFields:
+		return aPropertyArray
+	for aPropertyArray in aPropertyArrays.values():
+		if len(aPropertyArray) == numberOfFields:
+			return aPropertyArray
+	return ["Property" + str(propertyIndex + 1) for propertyIndex in range(numberOfFields)]
+
+def getPropertyValue(item):
+	aItem = item.split("=")
+	if len(aItem) == 1:
+		return aItem[0]
+	return aItem[1]
+
+'''
+The differences of a section are compared through an index of the other side, which is built once per section.
+Every record is then looked up by its label instead of rescanning the whole file for each line, so the comparison
+is linear in the number of differences.
+Settings are looked up by key, hierarchies without weight by the whole line ignoring the case, hierarchies with
+weight by parent;child and members by label, ignoring the case, and number of properties.
+'''
+def buildSectionIndex(records):
+	sectionIndex = {"settings": {}, "lines": set(), "hierarchies": {}, "members": {}}
+	for record in records:
+		recordType = type(record)
+		if recordType is Member:
+			sectionIndex["members"].setdefault((record.label.upper(), len(record.properties)), []).append(record.properties)
+		elif recordType is HierarchyEdge:
+			if record.weight is None:
+				sectionIndex["lines"].add(record.line.upper())
 			else:
-				s_file = file2
-				d_file = file1
-				processfile21 = True
-			from_file = open(s_file, "r", encoding="cp1252")
-			to_file = open(d_file, "r", encoding="cp1252")
-			i = 0
-			for line1 in from_file:
-				to_file.seek(0,0)
-				aline1 = line1.split(";")
-				index = 0
-				writtentoFile = False
-				exists = False
-				for item in aMemLength:
-					if len(aline1) == item:
-						aPropertyArray = aMemArray[index]
+				sectionIndex["hierarchies"].setdefault(record.parent + ";" + record.child, []).append(record.weight)
+		elif recordType is Setting:
+			sectionIndex["settings"].setdefault(record.key, []).append(record.value)
+	return sectionIndex
+
+'''
+The properties of the members found on both sides are compared column by column. The matched members of the same
+number of properties are put in two object arrays, one row per member and one column per property, aligned by label,
+and the columns are compared in bulk, numpy is used for it when it is installed. Only the properties which differ
+are then checked ignoring the case and against the DefaultParent and Descriptions rules.
+'''
+def findPropertyDifferences(pairs):
+	differences = [[] for pair in pairs]
+	groups = {}
+	for pairIndex, pair in enumerate(pairs):
+		groups.setdefault(len(pair[0]), []).append(pairIndex)
+	numpy = getNumpy() if len(pairs) > 1 else None
+	for pairIndexes in groups.values():
+		if numpy is not None and len(pairIndexes) > 1:
+			columns1 = numpy.array([pairs[pairIndex][0] for pairIndex in pairIndexes], dtype=object)
+			columns2 = numpy.array([pairs[pairIndex][1] for pairIndex in pairIndexes], dtype=object)
+			for row, propertyIndex in numpy.argwhere(columns1 != columns2).tolist():
+				differences[pairIndexes[row]].append(propertyIndex)
+		else:
+			for pairIndex in pairIndexes:
+				aline1, aline2 = pairs[pairIndex]
+				differences[pairIndex] = [propertyIndex for propertyIndex in range(len(aline1)) if aline1[propertyIndex] != aline2[propertyIndex]]
+	return differences
+
+def compareMemberProperties(dimensionName, aline1, aline2, propertyIndexes, aPropertyArray):
+	defaultParentIndex = len(aline2) - 2
+	descriptionIndex = len(aline2) - 1
+	for propertyIndex in propertyIndexes:
+		item = aline1[propertyIndex]
+		item2 = aline2[propertyIndex]
+		if item.upper() == item2.upper():
+			continue
+		if propertyIndex == defaultParentIndex:
+			value1 = getPropertyValue(item)
+			value2 = getPropertyValue(item2)
+			if (value1 == "#root" and value2 == "") or (value1 == "" and value2 == "#root"):
+				continue
+			yield [dimensionName, aline1[0], aPropertyArray[propertyIndex], value1.strip(), value2.strip()]
+		elif propertyIndex == descriptionIndex and getPropertyValue(item).strip() == getPropertyValue(item2).strip():
+			continue
+		else:
+			yield [dimensionName, aline1[0], aPropertyArray[propertyIndex], item.strip(), item2.strip()]
+
+def compareAgainstIndex(dimension, fromRecords, toIndex, processfile12, customOrder=None):
+	for recordNumber, row in compareRecordsAgainstIndex(dimension, fromRecords, toIndex, processfile12, customOrder):
+		yield row
+
+def compareRecordsAgainstIndex(dimension, fromRecords, toIndex, processfile12, customOrder=None):
+	dimensionName = dimension[:len(dimension)-1]
+	metadataSection = getMetadataSection(dimension)
+	if processfile12:
+		pairs = []
+		for record in fromRecords:
+			if type(record) is Member:
+				for properties2 in toIndex["members"].get((record.label.upper(), len(record.properties)), []):
+					pairs.append((record.properties, properties2))
+		pairDifferences = iter(findPropertyDifferences(pairs))
+	for recordNumber, record in enumerate(fromRecords):
+		recordType = type(record)
+		missingMember = None
+		if recordType is Member:
+			matches = toIndex["members"].get((record.label.upper(), len(record.properties)))
+			if matches is None:
+				missingMember = record.label
+			elif processfile12:
+				aPropertyArray = getPropertyArray(dimension, len(record.properties), customOrder)
+				for properties2 in matches:
+					for row in compareMemberProperties(dimensionName, record.properties, properties2, next(pairDifferences), aPropertyArray):
+						yield recordNumber, row
+		elif recordType is HierarchyEdge and record.weight is None:
+			if record.line.upper() not in toIndex["lines"]:
+				missingMember = record.line
+		elif recordType is HierarchyEdge:
+			hier1 = record.parent + ";" + record.child
+			weights = toIndex["hierarchies"].get(hier1)
+			if weights is None:
+				missingMember = record.line
+			elif processfile12:
+				for aggweight2 in weights:
+					if record.weight != aggweight2:
+						yield recordNumber, [dimensionName, hier1, 'aggrweight', record.weight, aggweight2]
+		elif recordType is Setting:
+			values = toIndex["settings"].get(record.key)
+			if values is None:
+				missingMember = record.line
+			elif processfile12:
+				for value2 in values:
+					if record.value != value2:
+						yield recordNumber, [dimensionName, record.key, "Value", record.value.strip(), value2.strip()]
 						break
-					index = index + 1	
-				
-				if len(aline1) == 1:
-					aline1Split = aline1[0].split("=")
-					for line2 in to_file:
-						aline2 = line2.split(";")
-						if len(aline2) == 1:
-							aline2Split = aline2[0].split("=")
-							if aline1Split[0] == aline2Split[0]:
-								exists = True
-								writtentoFile = True
-								if aline1Split[1] != aline2Split[1] and processfile12 == True:
-									CSVWriter.writerow([dimension[:len(dimension)-1],aline1Split[0], "Value", aline1Split[1].strip(),aline2Split[1].strip()])
-									break
-					if exists == False and processfile12 == True:
-						CSVWriter.writerow([dimension[:len(dimension)-1], line1.strip(), getMetadataSection(dimension),"", "Missing"])
-					elif exists == False and processfile21 == True:
-						CSVWriter.writerow([dimension[:len(dimension)-1], line1.strip(), getMetadataSection(dimension), "Missing"])
-				elif len(aline1) == 2:
-					for line2 in to_file:
-						if line1.upper() == line2.upper():
-							exists = True
-							break
-					if exists == False and processfile12 == True:
-						CSVWriter.writerow([dimension[:len(dimension)-1], line1.strip(), getMetadataSection(dimension), "", "Missing"])
-						writtentoFile = True
-					elif exists == False and processfile21 == True:
-						CSVWriter.writerow([dimension[:len(dimension)-1], line1.strip(), getMetadataSection(dimension), "Missing"])
-						writtentoFile = True
-				elif len(aline1) == 3:
-					hier1 = aline1[0] + ";" + aline1[1]
-					aggweight1 = aline1[2]
-					for line2 in to_file:
-						aline2 = line2.split(";")
-						if len(aline1) == len(aline2):
-							hier2 = aline2[0] + ";" + aline2[1]
-							aggweight2 = aline2[2]
-							if hier1 == hier2:
-								exists = True
-								if processfile21 == True:
-									writtentoFile = True
-								if processfile12 == True:
-									if aggweight1 == aggweight2:
-										pass
-									else:
-										CSVWriter.writerow([dimension[:len(dimension)-1], hier2.strip(), 'aggrweight', aggweight1.strip(), aggweight2.strip()])
-										writtentoFile = True
-					if exists == False and processfile12 == True:
-						CSVWriter.writerow([dimension[:len(dimension)-1], line1.strip(), getMetadataSection(dimension), "", "Missing"])
-						writtentoFile = True
-					elif exists == False and processfile21 == True:
-						CSVWriter.writerow([dimension[:len(dimension)-1], line1.strip(), getMetadataSection(dimension), "Missing"])
-						writtentoFile = True
-				elif processfile12:
-					for line2 in to_file:
-						aline2 = line2.split(";")
-						defaultParentIndex = len(aline2) - 2
-						descriptionIndex = len(aline2) - 1
-						if aline1[0].upper() == aline2[0].upper() and len(aline1) == len(aline2):
-							exists = True
-							
-							propertyIndex = 0
-							for item in aline1:
-								if item.upper() != aline2[propertyIndex].upper():
-									if (defaultParentIndex == propertyIndex):
-										if (item.split("=")[1] == "#root" and aline2[propertyIndex].split("=")[1] =="") or item.split("=")[1] == "" and aline2([propertIndex].split("=")[1] =="#root"):
-											pass
-										else:
-											CSVWriter.writerow([dimension[:len(dimension)-1], aline1[0], aPropertyArray[propertyIndex],item.split("=")[1].strip(), aline2[propertyIndex].split("=")[1].strip()])
-									elif (descriptionIndex == propertyIndex) and (item.split("=")[1].strip() ==aline2[propertyIndex].split("=")[1].strip()):
-										pass
-									else:
-										CSVWriter.writerow([dimension[:len(dimension)-1], aline1[0], aPropertyArray[propertyIndex],item.strip(), aline2[propertyIndex].strip()])
-								propertyIndex = propertyIndex + 1
-				elif processfile21:
-					for line2 in to_file:
-						aline2 = line2.split(";")
-						if aline1[0].upper() == aline2[0].upper() and len(aline1) == len(aline2):
-							exists = True
-				if exists == False and writtentoFile == False and processfile12 == True:
-					CSVWriter.writerow([dimension[:len(dimension)-1], aline1[0].strip(), getMetadataSection(dimension), "", "Missing"])
-				elif exists == False and writtentoFile == False and processfile21 == True:
-					CSVWriter.writerow([dimension[:len(dimension)-1], aline1[0].strip(), getMetadataSection(dimension), "Missing"])
-				i = i + 1
-			from_file.close()
-			to_file.close()
+		if missingMember is not None:
+			if processfile12:
+				yield recordNumber, [dimensionName, missingMember, metadataSection, "", "Missing"]
+			else:
+				yield recordNumber, [dimensionName, missingMember, metadataSection, "Missing"]
+
+'''
+Compares the differences of one section, records only in file1 are compared against file2 first and then the records
+only in file2 are compared against file1. The rows are yielded in that order. Hierarchy sections are compared by
+compareHierarchySection.
+compareSectionRecords yields every row with the file, 1 or 2, and the number of the record it was found for, this is
+used to put the rows of the sections compared in pieces back in the order of a whole section.
+'''
+def compareSection(dimension, records1, records2, customOrder=None, sectionLines=None):
+	for fileNumber, recordNumber, row in compareSectionRecords(dimension, records1, records2, customOrder, sectionLines):
+		yield row
+
+def compareSectionRecords(dimension, records1, records2, customOrder=None, sectionLines=None):
+	if getMetadataSection(dimension) == "Hierarchy":
+		return compareHierarchySection(dimension, records1, records2, customOrder, sectionLines)
+	return compareMemberSection(dimension, records1, records2, customOrder)
+
+def compareMemberSection(dimension, records1, records2, customOrder=None):
+	index1 = buildSectionIndex(records1)
+	index2 = buildSectionIndex(records2)
+	for recordNumber, row in compareRecordsAgainstIndex(dimension, records1, index2, True, customOrder):
+		yield 1, recordNumber, row
+	for recordNumber, row in compareRecordsAgainstIndex(dimension, records2, index1, False, customOrder):
+		yield 2, recordNumber, row
+
+'''
+Hierarchy sections are compared as graphs. The edges of each side are loaded into a set of parent;child edges, keyed
+case insensitive, with the adjacency of every child to its parents. Edges only in file1 are removed edges, edges only
+in file2 are added edges, edges in both with different weights are aggrweight rows and edges with weight in both which
+are spelled in a different case are Case rows, the case of the edges without weight is ignored as it always was. When
+the child has exactly one parent in each file, a removed and an added edge of the child are reported as one row, the
+member moved from the parent in file1 to the parent in file2, instead of two Missing rows. A shared member which lost
+one parent and gained another is not moved, its edges are reported as Missing. The records are only the lines which
+differ, so the parents of a child are counted in sectionLines, the lines of the whole section in both files, and only
+for the children which could have moved. The comparison is linear in the number of edges.
+'''
+def getEdgeKey(record):
+	return (record.parent.upper(), record.child.upper(), record.weight is not None)
+
+def countChildParents(lines):
+	childParents = collections.Counter()
+	for line in lines:
+		fields = line.split(";")
+		if len(fields) in (2, 3):
+			childParents[fields[1].strip().upper()] += 1
+	return childParents
+
+def buildHierarchyGraph(records):
+	edges = {}
+	childParents = {}
+	for record in records:
+		if type(record) is HierarchyEdge:
+			edges.setdefault(getEdgeKey(record), []).append(record)
+			childParents.setdefault(record.child.upper(), []).append(record)
+	return edges, childParents
+
+def compareHierarchySection(dimension, records1, records2, customOrder=None, sectionLines=None):
+	dimensionName = dimension[:len(dimension)-1]
+	metadataSection = getMetadataSection(dimension)
+	edges1, childParents1 = buildHierarchyGraph(records1)
+	edges2, childParents2 = buildHierarchyGraph(records2)
+	index1 = buildSectionIndex([record for record in records1 if type(record) is not HierarchyEdge])
+	index2 = buildSectionIndex([record for record in records2 if type(record) is not HierarchyEdge])
+	addedParents = {}
+	for child, parents in childParents2.items():
+		addedParents[child] = collections.deque(record for record in parents if getEdgeKey(record) not in edges1)
+	movedEdges = set()
+	childParents = None
+	for recordNumber, record in enumerate(records1):
+		if type(record) is not HierarchyEdge:
+			for row in compareAgainstIndex(dimension, [record], index2, True, customOrder):
+				yield 1, recordNumber, row
+			continue
+		edgeKey = getEdgeKey(record)
+		if edgeKey in edges2:
+			for record2 in edges2[edgeKey]:
+				if record.weight is not None and (record.parent != record2.parent or record.child != record2.child):
+					yield 1, recordNumber, [dimensionName, record.child, "Case", record.parent + ";" + record.child, record2.parent + ";" + record2.child]
+				if record.weight is not None and record.weight != record2.weight:
+					yield 1, recordNumber, [dimensionName, record.parent + ";" + record.child, 'aggrweight', record.weight, record2.weight]
+			continue
+		candidates = addedParents.get(record.child.upper())
+		if candidates and childParents is None:
+			if sectionLines is None:
+				sectionLines = ([record.line for record in records1], [record.line for record in records2])
+			childParents = (countChildParents(sectionLines[0]), countChildParents(sectionLines[1]))
+		if candidates and childParents[0][edgeKey[1]] == 1 and childParents[1][edgeKey[1]] == 1:
+			record2 = candidates.popleft()
+			movedEdges.add(id(record2))
+			yield 1, recordNumber, [dimensionName, record.child, "Moved", record.parent, record2.parent]
+			if record.weight != record2.weight and record.weight is not None and record2.weight is not None:
+				yield 1, recordNumber, [dimensionName, record.child, 'aggrweight', record.weight, record2.weight]
+			continue
+		yield 1, recordNumber, [dimensionName, record.line, metadataSection, "", "Missing"]
+	for recordNumber, record in enumerate(records2):
+		if type(record) is not HierarchyEdge:
+			for row in compareAgainstIndex(dimension, [record], index1, False, customOrder):
+				yield 2, recordNumber, row
+		elif getEdgeKey(record) not in edges1 and id(record) not in movedEdges:
+			yield 2, recordNumber, [dimensionName, record.line, metadataSection, "Missing"]
+
+def readDifferenceRecords(differenceFile):
+	with open(differenceFile, "r", encoding="cp1252") as difference:
+		return [record for record in map(parseLine, difference) if record is not None]
+
+def compare_files(diffFilePath, dimension, sectionLines=None):
+	startTime = time.perf_counter()
+	with runProfile.stage("compare"):
+		records1 = readDifferenceRecords(getFullPath(diffFilePath, "file1.txt"))
+		records2 = readDifferenceRecords(getFullPath(diffFilePath, "file2.txt"))
+		rows = list(compareSection(dimension, records1, records2, listOfCustDimensions, sectionLines))
+		with open(differencesfilePath, "a", encoding="cp1252", newline="") as outputCSVFile:
+			CSVWriter = csv.writer(outputCSVFile)
+			CSVWriter.writerows(rows)
+	runProfile.addStage("compare", records=len(records1) + len(records2))
+	runProfile.addSection(dimension, differences=len(records1) + len(records2), rows=len(rows), compare_seconds=time.perf_counter() - startTime)
 	
+'''
+In memory pipeline, used with --in-memory. Each metadata file is read once and its trimmed lines are split by section.
+The lines of a section are prefiltered as multisets and only the differing lines are parsed into records, which are
+passed straight to the comparison and then to the results file. Nothing is written to disk except the results file.
+'''
+def splitSections(trimmedLines):
+	sections = {}
+	sectionLines = None
+	for line in trimmedLines:
+		if line == "":
+			continue
+		if line[0] == "!":
+			record = parseLine(line)
+			if type(record) is SectionHeader:
+				sectionLines = []
+				sections[record.name] = sectionLines
+				continue
+			if type(record) is Directive:
+				continue
+		if sectionLines is not None:
+			sectionLines.append(line)
+	return sections
+
+def readSections(metadataFilePath, executor=None, sectionIndexes=None):
+	if executor is not None and getCpuCount() > 1 and os.path.getsize(metadataFilePath) > parseChunkSize and getCompression(metadataFilePath) is None:
+		return readSectionsInChunks(metadataFilePath, executor, sectionIndexes)
+	with openMetadataFile(metadataFilePath) as metadataFile:
+		return splitSections(map(trimLine, metadataFile))
+
+'''
+With --workers a metadata file bigger than parseChunkSize is read in chunks on the worker processes, so a section like
+!MEMBERS=Entity which holds most of the lines is not trimmed on one core. The file is memory mapped and cut into byte
+ranges which end after a line break, each worker trims the lines of its range and returns them as one text per section
+found in the range, and the texts are joined back in the order of the ranges. The first text of a range continues the
+section of the range before it. Only the first and the last section of a range can go on in the next range, so each
+worker also counts the lines of these two, and when a section of file1 spans several ranges its partial counts are
+merged into its baseline index. That section is then compared in the main process on the merged index while the
+workers compare the other sections, the sections within one range are indexed when they are compared. Compressed
+files are read as a stream as before.
+The chunks take as much processor time as reading the file in one go and only win when they run at the same time, so
+the file is read in one go when the process can use a single CPU, whatever the number of workers.
+'''
+parseChunkSize = 4 * 1024 * 1024
+
+def getCpuCount():
+	if hasattr(os, "sched_getaffinity"):
+		return len(os.sched_getaffinity(0))
+	return os.cpu_count() or 1
+
+def getChunkRanges(metadataFilePath, chunkSize):
+	import mmap
+	chunkRanges = []
+	with open(metadataFilePath, "rb") as metadataFile, mmap.mmap(metadataFile.fileno(), 0, access=mmap.ACCESS_READ) as mappedFile:
+		start = 0
+		while start < len(mappedFile):
+			end = mappedFile.find(b"\n", start + chunkSize)
+			end = len(mappedFile) if end == -1 else end + 1
+			chunkRanges.append((start, end))
+			start = end
+	return chunkRanges
+
+def readSectionChunk(metadataFilePath, start, end, indexEdges=False):
+	import mmap
+	with open(metadataFilePath, "rb") as metadataFile, mmap.mmap(metadataFile.fileno(), 0, access=mmap.ACCESS_READ) as mappedFile:
+		text = mappedFile[start:end].decode("cp1252")
+	sectionTexts = []
+	sectionName = None
+	sectionLines = []
+	for line in text.replace("\r\n", "\n").replace("\r", "\n").split("\n"):
+		line = trimLine(line)
+		if line == "":
+			continue
+		if line[0] == "!":
+			record = parseLine(line)
+			if type(record) is SectionHeader:
+				sectionTexts.append((sectionName, "\n".join(sectionLines)))
+				sectionName = record.name
+				sectionLines = []
+				continue
+			if type(record) is Directive:
+				continue
+		sectionLines.append(line)
+	sectionTexts.append((sectionName, "\n".join(sectionLines)))
+	if indexEdges:
+		return [(sectionName, sectionText, collections.Counter(sectionText.split("\n")) if sectionText and textNumber in (0, len(sectionTexts) - 1) else None)
+			for textNumber, (sectionName, sectionText) in enumerate(sectionTexts)]
+	return [(sectionName, sectionText, None) for sectionName, sectionText in sectionTexts]
+
+def mergeSectionIndexes(lines, partialCounts):
+	counts = partialCounts[0]
+	for pieceCounts in partialCounts[1:]:
+		counts.update(pieceCounts)
+	return {"counts": counts, "positions": dict(zip(reversed(lines), range(len(lines) - 1, -1, -1))),
+			"duplicates": [line for line, count in counts.items() if count > 1]}
+
+def readSectionsInChunks(metadataFilePath, executor, sectionIndexes=None):
+	chunkRanges = getChunkRanges(metadataFilePath, parseChunkSize)
+	printLine("Reading {} in {} chunks on the workers".format(metadataFilePath, len(chunkRanges)))
+	futures = [executor.submit(readSectionChunk, metadataFilePath, start, end, sectionIndexes is not None) for start, end in chunkRanges]
+	sections = {}
+	partialCounts = {}
+	sectionName = None
+	sectionLines = None
+	for future in futures:
+		for textSectionName, sectionText, pieceCounts in future.result():
+			if textSectionName is not None:
+				sectionName = textSectionName
+				sectionLines = []
+				sections[sectionName] = sectionLines
+				partialCounts[sectionName] = []
+			if sectionLines is not None and sectionText:
+				if pieceCounts is not None:
+					partialCounts[sectionName].append(pieceCounts)
+				sectionLines.extend(sectionText.split("\n"))
+	if sectionIndexes is not None:
+		for sectionName, sectionPartialCounts in partialCounts.items():
+			if len(sectionPartialCounts) > 1:
+				sectionIndexes[sectionName] = mergeSectionIndexes(sections[sectionName], sectionPartialCounts)
+	return sections
+
+'''
+The lines of a section are compared as multisets, the order of the lines does not matter. The baseline section is
+indexed by the count and first position of its lines, the lines of the other file which are beyond the count in the
+baseline and the lines of the baseline which are beyond the count in the other file are found with hash lookups, so
+a section which is only reordered between the two exports has no differences. The differences of the baseline keep the
+order of the baseline and those of the other file keep its own order.
+'''
+def indexBaselineSection(lines):
+	counts = collections.Counter(lines)
+	return {"counts": counts, "positions": dict(zip(reversed(lines), range(len(lines) - 1, -1, -1))),
+			"duplicates": [line for line, count in counts.items() if count > 1]}
+
+def findLineDifferences(baselineIndex, targetLines):
+	counts = baselineIndex["counts"]
+	positions = baselineIndex["positions"]
+	targetDifferences = []
+	targetCounts = {}
+	for line in targetLines:
+		targetCount = targetCounts.get(line, 0) + 1
+		targetCounts[line] = targetCount
+		if targetCount > counts.get(line, 0):
+			targetDifferences.append(line)
+	missingLines = [(positions[line], line, counts[line]) for line in counts.keys() - targetCounts.keys()]
+	for line in baselineIndex["duplicates"]:
+		if 0 < targetCounts.get(line, 0) < counts[line]:
+			missingLines.append((positions[line], line, counts[line] - targetCounts[line]))
+	baselineDifferences = []
+	for position, line, count in sorted(missingLines):
+		baselineDifferences.extend([line] * count)
+	return baselineDifferences, targetDifferences
+
+def findBaselineDifferences(baselineIndex, targetLines):
+	baselineDifferences, targetDifferences = findLineDifferences(baselineIndex, targetLines)
+	return list(map(parseLine, baselineDifferences)), list(map(parseLine, targetDifferences))
+
+def findSectionDifferences(lines1, lines2):
+	return findBaselineDifferences(indexBaselineSection(lines1), lines2)
+
+'''
+With --report-reorder the lines which are in both files but at a different place are reported with an Order row and
+their positions in the section of each file. The n-th occurrence of a line in file1 is paired with the n-th occurrence
+in file2, the longest run of pairs which keeps its order in both files is taken as unchanged and every other pair is
+reported, so moving one member reports that member and not all the members after it.
+'''
+def getOrderName(record):
+	if type(record) is Member:
+		return record.label
+	if type(record) is HierarchyEdge:
+		return record.parent + ";" + record.child
+	if type(record) is Setting:
+		return record.key
+	return record.line
+
+def findReorderedLines(lines1, lines2):
+	occurrences = {}
+	for position2, line in enumerate(lines2):
+		occurrences.setdefault(line, collections.deque()).append(position2)
+	pairs = []
+	for position1, line in enumerate(lines1):
+		positions2 = occurrences.get(line)
+		if positions2:
+			pairs.append((position1, positions2.popleft(), line))
+	import bisect
+	tails = []
+	tailPairs = []
+	previousPairs = []
+	for pairIndex, pair in enumerate(pairs):
+		tailIndex = bisect.bisect_left(tails, pair[1])
+		previousPairs.append(tailPairs[tailIndex - 1] if tailIndex else -1)
+		if tailIndex == len(tails):
+			tails.append(pair[1])
+			tailPairs.append(pairIndex)
+		else:
+			tails[tailIndex] = pair[1]
+			tailPairs[tailIndex] = pairIndex
+	pairsInOrder = set()
+	pairIndex = tailPairs[-1] if tailPairs else -1
+	while pairIndex != -1:
+		pairsInOrder.add(pairIndex)
+		pairIndex = previousPairs[pairIndex]
+	return [pair for pairIndex, pair in enumerate(pairs) if pairIndex not in pairsInOrder]
+
+def compareSectionOrder(dimension, lines1, lines2):
+	dimensionName = dimension[:len(dimension)-1]
+	for position1, position2, line in findReorderedLines(lines1, lines2):
+		yield [dimensionName, getOrderName(parseLine(line)), "Order", str(position1 + 1), str(position2 + 1)]
+
+'''
+Snapshot cache of the in-memory pipeline, used only when --cache-folder is given, by default nothing is written but the
+results. The sections read from a metadata file are stored in the cache folder as a
+zlib compressed pickle, named by the sha256 of the file content and the snapshot version, so the next run with the same
+file loads the sections instead of reading and trimming the file again. snapshotVersion must be increased whenever
+readSections changes what it returns.
+The cache is bounded by size, the least recently used snapshots are deleted once the folder grows beyond the limit,
+except the snapshot which was just written.
+'''
+snapshotVersion = 1
+
+def getContentHash(metadataFilePath):
+	import hashlib
+	contentHash = hashlib.sha256()
+	with open(metadataFilePath, "rb") as metadataFile:
+		for block in iter(lambda: metadataFile.read(1024 * 1024), b""):
+			contentHash.update(block)
+	return contentHash.hexdigest()
+
+def readSnapshot(snapshotPath):
+	import pickle
+	import zlib
+	with open(snapshotPath, "rb") as snapshotFile:
+		sections = pickle.loads(zlib.decompress(snapshotFile.read()))
+	return {sectionName: sectionLines.split("\n") if sectionLines else [] for sectionName, sectionLines in sections.items()}
+
+def writeSnapshot(snapshotPath, sections):
+	import pickle
+	import zlib
+	sections = {sectionName: "\n".join(sectionLines) for sectionName, sectionLines in sections.items()}
+	temporaryPath = snapshotPath + "." + str(os.getpid()) + ".tmp"
+	with open(temporaryPath, "wb") as snapshotFile:
+		snapshotFile.write(zlib.compress(pickle.dumps(sections, pickle.HIGHEST_PROTOCOL), 1))
+	os.replace(temporaryPath, snapshotPath)
+
+def evictSnapshots(cacheFolder, cacheSize, keptSnapshotPath):
+	snapshots = []
+	for entry in os.scandir(cacheFolder):
+		if entry.name.endswith(".snapshot") and entry.path != keptSnapshotPath:
+			snapshots.append((entry.stat().st_mtime, entry.stat().st_size, entry.path))
+	totalSize = os.path.getsize(keptSnapshotPath) + sum(snapshot[1] for snapshot in snapshots)
+	for lastUsed, size, snapshotPath in sorted(snapshots):
+		if totalSize <= cacheSize:
+			break
+		try:
+			os.remove(snapshotPath)
+		except OSError:
+			continue
+		totalSize = totalSize - size
+
+def loadSections(metadataFilePath, cacheFolder=None, cacheSize=0, executor=None, sectionIndexes=None):
+	if cacheFolder is None:
+		return readSections(metadataFilePath, executor, sectionIndexes)
+	import pickle
+	import zlib
+	snapshotPath = getFullPath(cacheFolder, getContentHash(metadataFilePath) + "_v" + str(snapshotVersion) + ".snapshot")
+	if bPathExists(snapshotPath):
+		try:
+			sections = readSnapshot(snapshotPath)
+			os.utime(snapshotPath)
+			printLine("Loaded the sections from the snapshot " + snapshotPath)
+			return sections
+		except (OSError, EOFError, ValueError, pickle.UnpicklingError, zlib.error):
+			printWarningLines("Snapshot " + snapshotPath + " could not be read... reading the metadata file")
+	sections = readSections(metadataFilePath, executor, sectionIndexes)
+	try:
+		os.makedirs(cacheFolder, exist_ok=True)
+		writeSnapshot(snapshotPath, sections)
+		evictSnapshots(cacheFolder, cacheSize, snapshotPath)
+	except OSError as error:
+		printWarningLines("Snapshot could not be saved to " + cacheFolder + ": " + str(error))
+	return sections
+
+'''
+Incremental comparison, used with --state after small fixes to one of the files. The state file keeps from the last run
+the fingerprint of every section of both files, a blake2b of its trimmed lines, and the rows found for the section, as
+a zlib compressed pickle like the snapshots. A section whose lines are the same on both sides as in the last run is not
+compared again and its rows are taken from the state, only the sections which changed in either file are compared.
+The state is used only when the custom order and --report-reorder are those of the last run, and it is replaced at the
+end of every run. The sections are then reported as new when they differ and did not in the last run, resolved when
+they differed and do not any more, and still differing.
+'''
+stateVersion = 1
+stateChanges = None
+
+def getSectionFingerprint(sectionLines):
+	import hashlib
+	return hashlib.blake2b("\n".join(sectionLines).encode("utf-8"), digest_size=16).hexdigest()
+
+def readState(statePath, customOrder, reportReorder):
+	import pickle
+	import zlib
+	if not bPathExists(statePath):
+		return {}
+	try:
+		with open(statePath, "rb") as stateFile:
+			state = pickle.loads(zlib.decompress(stateFile.read()))
+	except (OSError, EOFError, ValueError, pickle.UnpicklingError, zlib.error):
+		printWarningLines("State " + statePath + " could not be read... comparing all the sections")
+		return {}
+	if state.get("version") != stateVersion or state.get("custom_order") != customOrder or state.get("report_reorder") != reportReorder:
+		printWarningLines("State " + statePath + " is of a run with other settings... comparing all the sections")
+		return {}
+	return state["sections"]
+
+def writeState(statePath, customOrder, reportReorder, sections):
+	import pickle
+	import zlib
+	temporaryPath = statePath + "." + str(os.getpid()) + ".tmp"
+	try:
+		with open(temporaryPath, "wb") as stateFile:
+			stateFile.write(zlib.compress(pickle.dumps({"version": stateVersion, "custom_order": customOrder, "report_reorder": reportReorder,
+				"sections": sections}, pickle.HIGHEST_PROTOCOL), 1))
+		os.replace(temporaryPath, statePath)
+	except OSError as error:
+		printWarningLines("State could not be saved to " + statePath + ": " + str(error))
+
+def reportStateChanges(previousSections, sectionRows):
+	sectionChanges = {"new": [], "resolved": [], "still differing": []}
+	for sectionName, rows in sectionRows.items():
+		bDifferedBefore = sectionName in previousSections and len(previousSections[sectionName]["rows"]) > 0
+		if rows:
+			sectionChanges["still differing" if bDifferedBefore else "new"].append(sectionName)
+		elif bDifferedBefore:
+			sectionChanges["resolved"].append(sectionName)
+	printLines("Differences by section since the last run")
+	for change, sectionNames in sectionChanges.items():
+		printLine("{:<16}{}".format(change, ", ".join(processBlock(sectionName) for sectionName in sectionNames) or "-"))
+	return sectionChanges
+
+def compareSectionPair(sectionName, lines1, lines2, customOrder=None, reportReorder=False, baselineIndex=None):
+	startTime = time.perf_counter()
+	if baselineIndex is None:
+		baselineIndex = indexBaselineSection(lines1)
+	differences1, differences2 = findBaselineDifferences(baselineIndex, lines2)
+	diffTime = time.perf_counter()
+	rows = list(compareSection(sectionName, differences1, differences2, customOrder, (lines1, lines2)))
+	if reportReorder:
+		rows.extend(compareSectionOrder(sectionName, lines1, lines2))
+	return rows, {"lines": len(lines1) + len(lines2), "differences": len(differences1) + len(differences2), "rows": len(rows),
+		"diff_seconds": diffTime - startTime, "compare_seconds": time.perf_counter() - diffTime}
+
+def addSectionProfile(sectionName, sectionProfile):
+	runProfile.addSection(sectionName, **sectionProfile)
+	runProfile.addStage("diff", sectionProfile["diff_seconds"], sectionProfile["lines"])
+	runProfile.addStage("compare", sectionProfile["compare_seconds"], sectionProfile["differences"])
+
+'''
+The sections which are in both files, in the order of file1. The sections which are only in one of the files are
+reported and skipped, those of file2 once all the common sections are compared.
+'''
+def getCommonSections(sections1, sections2, metadataFile1, metadataFile2):
+	for sectionName in sections1:
+		if sectionName in sections2:
+			yield sectionName
+		else:
+			printWarningLines(processBlock(sectionName) + " doesn't exists in " + metadataFile2 + "... therefore skipping the comparison")
+	for sectionName in sections2:
+		if sectionName not in sections1:
+			printWarningLines(processBlock(sectionName) + " doesn't exists in " + metadataFile1 + "... therefore skipping the comparison")
+
+'''
+With --workers the sections are compared on a pool of processes, the biggest sections are submitted first. The rows
+are still collected in the order of the sections in file1, so the results file is the same as that of a serial run.
+'''
+def submitSectionPairs(executor, commonSections, sections1, sections2, customOrder, reportReorder=False):
+	futures = {}
+	for sectionName in sorted(commonSections, key=lambda name: len(sections1[name]) + len(sections2[name]), reverse=True):
+		futures[sectionName] = executor.submit(compareSectionPair, sectionName, sections1[sectionName], sections2[sectionName], customOrder, reportReorder)
+	return futures
+
+def compareInMemory(filePath, metadataFiles, workers=1, cacheFolder=None, cacheSize=0, reportReorder=False, statePath=None):
+	global stateChanges
+	executor = None
+	if workers > 1:
+		from concurrent.futures import ProcessPoolExecutor
+		executor = ProcessPoolExecutor(max_workers=workers)
+	try:
+		aSectionsInFiles = []
+		baselineIndexes = {}
+		for file in metadataFiles:
+			printLines("Separating members and hierarchies sections in metadata file " + file)
+			with runProfile.stage("read"):
+				sections = loadSections(getFullPath(filePath, file), cacheFolder, cacheSize, executor, None if aSectionsInFiles else baselineIndexes)
+			runProfile.addStage("read", records=sum(len(sectionLines) for sectionLines in sections.values()))
+			aSectionsInFiles.append(sections)
+			printLine("Completed ....")
+		sections1, sections2 = aSectionsInFiles
+		customOrder = getCustomOrder(getFullPath(filePath, metadataFiles[0]))
+		commonSections = [sectionName for sectionName in sections1 if sectionName in sections2]
+		reusedRows = {}
+		sectionRows = {}
+		if statePath is not None:
+			with runProfile.stage("fingerprint"):
+				fingerprints = {sectionName: (getSectionFingerprint(sections1[sectionName]), getSectionFingerprint(sections2[sectionName]))
+					for sectionName in commonSections}
+				previousSections = readState(statePath, customOrder, reportReorder)
+			runProfile.addStage("fingerprint", records=sum(len(sections1[sectionName]) + len(sections2[sectionName]) for sectionName in commonSections))
+			for sectionName in commonSections:
+				if sectionName in previousSections and previousSections[sectionName]["fingerprints"] == fingerprints[sectionName]:
+					reusedRows[sectionName] = previousSections[sectionName]["rows"]
+			printLine("{} of the {} sections are unchanged since the last run".format(len(reusedRows), len(commonSections)))
+		changedSections = [sectionName for sectionName in commonSections if sectionName not in reusedRows]
+		futures = {}
+		if executor is not None and len(changedSections) > 1:
+			futures = submitSectionPairs(executor, [sectionName for sectionName in changedSections if sectionName not in baselineIndexes],
+				sections1, sections2, customOrder, reportReorder)
+		for sectionName in getCommonSections(sections1, sections2, metadataFiles[0], metadataFiles[1]):
+			if sectionName in reusedRows:
+				printLines("Reusing the discrepancies in " + processBlock(sectionName) + " from the last run")
+				rows = reusedRows[sectionName]
+				runProfile.addSection(sectionName, lines=len(sections1[sectionName]) + len(sections2[sectionName]), rows=len(rows), reused=1)
+			else:
+				printLines("Finding discrepancies in " + processBlock(sectionName))
+				if sectionName not in futures:
+					with runProfile.stage():
+						rows, sectionProfile = compareSectionPair(sectionName, sections1[sectionName], sections2[sectionName], customOrder, reportReorder,
+							baselineIndexes.get(sectionName))
+				else:
+					with runProfile.stage("wait for workers"):
+						rows, sectionProfile = futures[sectionName].result()
+				addSectionProfile(sectionName, sectionProfile)
+			sectionRows[sectionName] = rows
+			for row in rows:
+				yield row
+	finally:
+		if executor is not None:
+			executor.shutdown(cancel_futures=True)
+	if statePath is not None:
+		writeState(statePath, customOrder, reportReorder, {sectionName: {"fingerprints": fingerprints[sectionName], "rows": rows}
+			for sectionName, rows in sectionRows.items()})
+		stateChanges = reportStateChanges(previousSections, sectionRows)
+
+'''
+N-way comparison, used with --targets. The baseline (file1) is read once and every section of it is indexed once by the
+count and position of its lines, each target is then compared against that shared index. The rows of all the targets are
+consolidated by Dimension, Member Name, Property and the value of the baseline into one row with a value column per
+file, a target without a row for it has the same value as the baseline. A target can have the same row more than once,
+for a line which is repeated in the baseline, the n-th of those rows of every target is consolidated into the n-th row.
+'''
+def compareTargets(filePath, baselineFile, targetFiles, cacheFolder=None, cacheSize=0, reportReorder=False):
+	printLines("Separating members and hierarchies sections in metadata file " + baselineFile)
+	with runProfile.stage("read"):
+		baselineSections = loadSections(getFullPath(filePath, baselineFile), cacheFolder, cacheSize)
+	runProfile.addStage("read", records=sum(len(sectionLines) for sectionLines in baselineSections.values()))
+	customOrder = getCustomOrder(getFullPath(filePath, baselineFile))
+	printLine("Completed ....")
+	baselineIndexes = {}
+	consolidatedRows = {sectionName: {} for sectionName in baselineSections}
+	for targetNumber, targetFile in enumerate(targetFiles):
+		printLines("Separating members and hierarchies sections in metadata file " + targetFile)
+		with runProfile.stage("read"):
+			targetSections = loadSections(getFullPath(filePath, targetFile), cacheFolder, cacheSize)
+		runProfile.addStage("read", records=sum(len(sectionLines) for sectionLines in targetSections.values()))
+		printLine("Completed ....")
+		for sectionName in getCommonSections(baselineSections, targetSections, baselineFile, targetFile):
+			printLines("Finding discrepancies in " + processBlock(sectionName) + " of " + targetFile)
+			with runProfile.stage():
+				if sectionName not in baselineIndexes:
+					baselineIndexes[sectionName] = indexBaselineSection(baselineSections[sectionName])
+				rows, sectionProfile = compareSectionPair(sectionName, baselineSections[sectionName], targetSections[sectionName], customOrder,
+					reportReorder, baselineIndexes[sectionName])
+			addSectionProfile(sectionName, sectionProfile)
+			sectionRows = consolidatedRows[sectionName]
+			occurrences = collections.Counter()
+			for row in rows:
+				key = (row[0], row[1], row[2], row[3])
+				occurrence = occurrences[key]
+				occurrences[key] = occurrence + 1
+				keyRows = sectionRows.setdefault(key, [])
+				if occurrence == len(keyRows):
+					keyRows.append({})
+				keyRows[occurrence][targetNumber] = row[4] if len(row) > 4 else ""
+	for sectionName in baselineSections:
+		for key, keyRows in consolidatedRows[sectionName].items():
+			for targetValues in keyRows:
+				yield list(key) + [targetValues.get(targetNumber, key[3]) for targetNumber in range(len(targetFiles))]
+
+'''
+External memory comparison, used with --external for metadata files larger than the memory. Each file is read once as
+a stream, the lines of every section are tagged with a group key and their position in the section and collected up to
+the memory budget, then sorted and spilled as a run to the temporary folder. The runs of the two files are merged and
+joined on the group key in a single pass, so only the lines of one group are in memory at a time.
+The group key holds every line a line can be compared with: the label of a member, the child of a hierarchy edge,
+which also has all its parents for the Moved rows, and the key of a setting. Each group is prefiltered and compared
+like a section, and its rows are tagged with the position of the record they were found for. The rows are sorted on
+that tag, spilled in the same way when there are more than the budget, so they come out in the order of the in-memory
+comparison.
+'''
+externalBatchSize = 10000
+
+def getLineGroupKey(line):
+	fields = line.split(";")
+	if len(fields) == 1:
+		return "S" + line.split("=")[0]
+	if len(fields) < 4:
+		return "H" + fields[1].upper()
+	return "M" + fields[0].upper()
+
+def getEntrySize(entry):
+	return sys.getsizeof(entry[-1]) + 120
+
+def writeRun(runFolder, entries):
+	entries.sort(key=lambda entry: entry[:-1])
+	import pickle
+	import tempfile
+	runFile, runPath = tempfile.mkstemp(suffix=".run", dir=runFolder)
+	with os.fdopen(runFile, "wb") as runFile:
+		for batchStart in range(0, len(entries), externalBatchSize):
+			pickle.dump(entries[batchStart:batchStart + externalBatchSize], runFile, protocol=pickle.HIGHEST_PROTOCOL)
+	return runPath
+
+def readRun(runPath):
+	import pickle
+	with open(runPath, "rb") as runFile:
+		while True:
+			try:
+				entries = pickle.load(runFile)
+			except EOFError:
+				return
+			for entry in entries:
+				yield entry
+
+def mergeRuns(runPaths, entries):
+	import heapq
+	entries.sort(key=lambda entry: entry[:-1])
+	return heapq.merge(entries, *[readRun(runPath) for runPath in runPaths], key=lambda entry: entry[:-1])
+
+def spillSections(metadataFilePath, runFolder, memoryBudget):
+	sectionRuns = {}
+	sectionEntries = {}
+	sectionLines = {}
+	bufferSize = 0
+	sectionName = None
+	position = 0
+	with openMetadataFile(metadataFilePath) as metadataFile:
+		for line in map(trimLine, metadataFile):
+			if line == "":
+				continue
+			if line[0] == "!":
+				record = parseLine(line)
+				if type(record) is SectionHeader:
+					sectionName = record.name
+					sectionRuns[sectionName] = []
+					sectionEntries[sectionName] = []
+					sectionLines[sectionName] = 0
+					position = 0
+					continue
+				if type(record) is Directive:
+					continue
+			if sectionName is None:
+				continue
+			entry = (getLineGroupKey(line), position, line)
+			sectionEntries[sectionName].append(entry)
+			sectionLines[sectionName] = sectionLines[sectionName] + 1
+			position = position + 1
+			bufferSize = bufferSize + getEntrySize(entry)
+			if bufferSize > memoryBudget:
+				for bufferedSection, entries in sectionEntries.items():
+					if entries:
+						sectionRuns[bufferedSection].append(writeRun(runFolder, entries))
+						sectionEntries[bufferedSection] = []
+				bufferSize = 0
+	return {sectionName: (sectionRuns[sectionName], sectionEntries[sectionName], sectionLines[sectionName]) for sectionName in sectionRuns}
+
+def findGroupDifferences(entries1, entries2):
+	counts1 = collections.Counter(entry[2] for entry in entries1)
+	counts2 = {}
+	differences2 = []
+	for groupKey, position, line in entries2:
+		count2 = counts2.get(line, 0) + 1
+		counts2[line] = count2
+		if count2 > counts1.get(line, 0):
+			differences2.append((position, line))
+	firstPositions = {}
+	for groupKey, position, line in entries1:
+		firstPositions.setdefault(line, position)
+	differences1 = []
+	for line, count1 in counts1.items():
+		for copy in range(count1 - counts2.get(line, 0)):
+			differences1.append((firstPositions[line], line))
+	differences1.sort()
+	return differences1, differences2
+
+def joinSectionGroups(entries1, entries2):
+	groups1 = itertools.groupby(entries1, key=lambda entry: entry[0])
+	groups2 = itertools.groupby(entries2, key=lambda entry: entry[0])
+	group1 = next(groups1, None)
+	group2 = next(groups2, None)
+	while group1 is not None or group2 is not None:
+		if group2 is None or (group1 is not None and group1[0] < group2[0]):
+			yield list(group1[1]), []
+			group1 = next(groups1, None)
+		elif group1 is None or group2[0] < group1[0]:
+			yield [], list(group2[1])
+			group2 = next(groups2, None)
+		else:
+			yield list(group1[1]), list(group2[1])
+			group1 = next(groups1, None)
+			group2 = next(groups2, None)
+
+def compareExternalSection(sectionName, spilledSection1, spilledSection2, runFolder, memoryBudget, customOrder=None):
+	entries1 = mergeRuns(spilledSection1[0], spilledSection1[1])
+	entries2 = mergeRuns(spilledSection2[0], spilledSection2[1])
+	rowRuns = []
+	rows = []
+	bufferSize = 0
+	sequence = 0
+	numberOfDifferences = 0
+	for groupEntries1, groupEntries2 in joinSectionGroups(entries1, entries2):
+		differences1, differences2 = findGroupDifferences(groupEntries1, groupEntries2)
+		if not differences1 and not differences2:
+			continue
+		numberOfDifferences = numberOfDifferences + len(differences1) + len(differences2)
+		positions = {1: differences1, 2: differences2}
+		records1 = [parseLine(line) for position, line in differences1]
+		records2 = [parseLine(line) for position, line in differences2]
+		sectionLines = ([entry[2] for entry in groupEntries1], [entry[2] for entry in groupEntries2])
+		for fileNumber, recordNumber, row in compareSectionRecords(sectionName, records1, records2, customOrder, sectionLines):
+			entry = (fileNumber, positions[fileNumber][recordNumber][0], sequence, row)
+			rows.append(entry)
+			sequence = sequence + 1
+			bufferSize = bufferSize + sum(map(sys.getsizeof, row)) + 120
+			if bufferSize > memoryBudget:
+				rowRuns.append(writeRun(runFolder, rows))
+				rows = []
+				bufferSize = 0
+	return numberOfDifferences, (entry[-1] for entry in mergeRuns(rowRuns, rows))
+
+def compareExternal(filePath, metadataFiles, memoryBudget, tempFolder=None):
+	import tempfile
+	runFolder = tempfile.mkdtemp(prefix="Metadata_Compare_", dir=tempFolder)
+	try:
+		aSpilledFiles = []
+		for file in metadataFiles:
+			printLines("Spilling the sorted sections of metadata file " + file + " to " + runFolder)
+			with runProfile.stage("spill"):
+				spilledSections = spillSections(getFullPath(filePath, file), runFolder, memoryBudget)
+			runProfile.addStage("spill", records=sum(spilledSection[2] for spilledSection in spilledSections.values()))
+			aSpilledFiles.append(spilledSections)
+			printLine("Completed ....")
+		spilledSections1, spilledSections2 = aSpilledFiles
+		customOrder = getCustomOrder(getFullPath(filePath, metadataFiles[0]))
+		for sectionName in spilledSections1:
+			if sectionName not in spilledSections2:
+				printWarningLines(processBlock(sectionName) + " doesn't exists in " + metadataFiles[1] + "... therefore skipping the comparison")
+				continue
+			printLines("Finding discrepancies in " + processBlock(sectionName))
+			startTime = time.perf_counter()
+			numberOfRows = 0
+			with runProfile.stage("merge"):
+				numberOfDifferences, rows = compareExternalSection(sectionName, spilledSections1[sectionName], spilledSections2[sectionName], runFolder, memoryBudget, customOrder)
+			mergeTime = time.perf_counter()
+			for row in rows:
+				numberOfRows = numberOfRows + 1
+				yield row
+			numberOfLines = spilledSections1[sectionName][2] + spilledSections2[sectionName][2]
+			runProfile.addStage("merge", records=numberOfLines)
+			runProfile.addSection(sectionName, lines=numberOfLines, differences=numberOfDifferences, rows=numberOfRows,
+				compare_seconds=mergeTime - startTime)
+		for sectionName in spilledSections2:
+			if sectionName not in spilledSections1:
+				printWarningLines(processBlock(sectionName) + " doesn't exists in " + metadataFiles[0] + "... therefore skipping the comparison")
+	finally:
+		import shutil
+		shutil.rmtree(runFolder, ignore_errors=True)
+
+'''
+Fingerprint check, used with --check by the CI gates which only need to know whether the metadata of two environments
+differ. Each file is streamed once, its lines are trimmed and split by section with the rules of splitSections and every
+section is reduced to the number of its lines and the sum modulo 2**128 of the 16 byte blake2b of each of its lines. The
+sum does not depend on the order of the lines, as in the comparison, it is the same in every run and it is kept while the
+file is read, so the memory does not grow with the size of the file. Only the sections whose fingerprints differ are
+printed and the exit code is 1 when any section differs, nothing is written and openpyxl is not imported. A file which
+cannot be read ends the check with the exit code 2. The check is stricter than the comparison, a section which differs
+only in the case of a line or in a DefaultParent of #root against blank differs here and has no rows there.
+'''
+fingerprintModulus = 2 ** 128
+
+def fingerprintSections(metadataFilePath):
+	import hashlib
+	sections = {}
+	sectionFingerprint = None
+	with openMetadataFile(metadataFilePath) as metadataFile:
+		for line in map(trimLine, metadataFile):
+			if line == "":
+				continue
+			if line[0] == "!":
+				record = parseLine(line)
+				if type(record) is SectionHeader:
+					sectionFingerprint = [0, 0]
+					sections[record.name] = sectionFingerprint
+					continue
+				if type(record) is Directive:
+					continue
+			if sectionFingerprint is not None:
+				lineHash = int.from_bytes(hashlib.blake2b(line.encode("utf-8"), digest_size=16).digest(), "big")
+				sectionFingerprint[0] = sectionFingerprint[0] + 1
+				sectionFingerprint[1] = (sectionFingerprint[1] + lineHash) % fingerprintModulus
+	return {sectionName: tuple(sectionFingerprint) for sectionName, sectionFingerprint in sections.items()}
+
+def readFingerprints(filePath, metadataFile):
+	try:
+		return fingerprintSections(getFullPath(filePath, metadataFile))
+	except Exception as error:
+		print("ERROR: {} could not be checked: {}".format(metadataFile, error), file=sys.stderr)
+		return None
+
+def checkMetadataFiles(filePath, baselineFile, targetFiles):
+	baselineFingerprints = readFingerprints(filePath, baselineFile)
+	if baselineFingerprints is None:
+		return 2
+	bDifferent = False
+	for targetFile in targetFiles:
+		targetFingerprints = readFingerprints(filePath, targetFile)
+		if targetFingerprints is None:
+			return 2
+		for sectionName in itertools.chain(baselineFingerprints, [name for name in targetFingerprints if name not in baselineFingerprints]):
+			fingerprint1 = baselineFingerprints.get(sectionName)
+			fingerprint2 = targetFingerprints.get(sectionName)
+			if fingerprint1 == fingerprint2:
+				continue
+			bDifferent = True
+			if fingerprint2 is None:
+				print("{}: {} doesn't exists in {}".format(targetFile, processBlock(sectionName), targetFile))
+			elif fingerprint1 is None:
+				print("{}: {} doesn't exists in {}".format(targetFile, processBlock(sectionName), baselineFile))
+			else:
+				print("{}: {} differs, {} lines in {} and {} lines in {}".format(targetFile, processBlock(sectionName),
+					fingerprint1[0], baselineFile, fingerprint2[0], targetFile))
+	return 1 if bDifferent else 0
+
+'''
+Comparison service, started with --serve. A long running process listens on a local HTTP port, jobs are posted to
+/compare as JSON with the absolute paths of file1 and file2 and are compared on a pool of --workers threads, at least 4,
+so several jobs are accepted at the same time. The sections read from a metadata file, with the custom order and the
+baseline indexes built for it, are kept in a LRU of --service-cache files keyed by the path, size and modification time
+of the file, so the baselines which are compared again and again are read and indexed once.
+With "format": "jsonl" the rows are streamed back as JSON lines, the header first and a last line with the number of
+rows, with "format": "xlsx" the results file is written and its path is returned. When the client goes away while the
+rows are streamed the job stops at its next batch, so it does not hold a worker of the pool. GET /status returns the
+files in the LRU and the run profile of the jobs. The files of a job and its results_file must be in --path, the folder
+the service serves, any other path is refused so the service cannot be used to read or write other files. --submit is
+the client, it posts one job and prints what the service returns.
+'''
+serviceBatchSize = 1000
+
+class ServiceCache:
+
+	def __init__(self, maximumFiles, cacheFolder=None, cacheSize=0):
+		self.maximumFiles = maximumFiles
+		self.cacheFolder = cacheFolder
+		self.cacheSize = cacheSize
+		self.metadataFiles = collections.OrderedDict()
+		self.lock = threading.Lock()
+
+	def getMetadataFile(self, metadataFilePath):
+		fileStat = os.stat(metadataFilePath)
+		fileKey = (os.path.realpath(metadataFilePath), fileStat.st_size, fileStat.st_mtime_ns)
+		with self.lock:
+			metadataFile = self.metadataFiles.get(fileKey)
+			if metadataFile is None:
+				metadataFile = {"path": fileKey[0], "loaded": threading.Event(), "sections": None, "indexes": {}, "customOrder": None}
+				self.metadataFiles[fileKey] = metadataFile
+				bLoad = True
+			else:
+				self.metadataFiles.move_to_end(fileKey)
+				bLoad = False
+			while len(self.metadataFiles) > self.maximumFiles:
+				self.metadataFiles.popitem(last=False)
+		if bLoad:
+			try:
+				with runProfile.stage("read"):
+					metadataFile["sections"] = loadSections(metadataFilePath, self.cacheFolder, self.cacheSize)
+					metadataFile["customOrder"] = getCustomOrder(metadataFilePath)
+				runProfile.addStage("read", records=sum(len(sectionLines) for sectionLines in metadataFile["sections"].values()))
+			except Exception:
+				with self.lock:
+					self.metadataFiles.pop(fileKey, None)
+				raise
+			finally:
+				metadataFile["loaded"].set()
+		metadataFile["loaded"].wait()
+		if metadataFile["sections"] is None:
+			return self.getMetadataFile(metadataFilePath)
+		return metadataFile
+
+	def getSectionIndex(self, metadataFile, sectionName):
+		sectionIndex = metadataFile["indexes"].get(sectionName)
+		if sectionIndex is None:
+			sectionIndex = indexBaselineSection(metadataFile["sections"][sectionName])
+			metadataFile["indexes"][sectionName] = sectionIndex
+		return sectionIndex
+
+	def getStatus(self):
+		with self.lock:
+			return [{"path": fileKey[0], "size": fileKey[1], "sections": len(metadataFile["sections"] or {}), "indexed_sections": len(metadataFile["indexes"])}
+				for fileKey, metadataFile in self.metadataFiles.items()]
+
+def compareServiceJob(serviceCache, job):
+	metadataFile1 = serviceCache.getMetadataFile(job["file1"])
+	metadataFile2 = serviceCache.getMetadataFile(job["file2"])
+	sections1 = metadataFile1["sections"]
+	sections2 = metadataFile2["sections"]
+	for sectionName in getCommonSections(sections1, sections2, job["file1"], job["file2"]):
+		with runProfile.stage():
+			rows, sectionProfile = compareSectionPair(sectionName, sections1[sectionName], sections2[sectionName], metadataFile1["customOrder"],
+				job.get("report_reorder", False), serviceCache.getSectionIndex(metadataFile1, sectionName))
+		addSectionProfile(sectionName, sectionProfile)
+		for row in rows:
+			yield row
+
+def isInFolder(filePath, folderPath):
+	folderPath = os.path.realpath(folderPath)
+	try:
+		return os.path.commonpath([os.path.realpath(filePath), folderPath]) == folderPath
+	except ValueError:
+		return False
+
+def getJobHeader(job):
+	return ["Dimension", "Member Name", "Property", os.path.basename(job["file1"]).split(".")[0], os.path.basename(job["file2"]).split(".")[0]]
+
+def writeServiceResponse(writer, status, contentType, body=None):
+	writer.write("HTTP/1.1 {}\r\nContent-Type: {}\r\nConnection: close\r\n".format(status, contentType).encode("latin-1"))
+	if body is not None:
+		writer.write("Content-Length: {}\r\n\r\n".format(len(body)).encode("latin-1") + body)
+	else:
+		writer.write(b"\r\n")
+
+async def streamServiceRows(serviceCache, executor, job, writer):
+	import asyncio
+	import json
+	loop = asyncio.get_running_loop()
+	queue = asyncio.Queue(maxsize=16)
+	stopStreaming = threading.Event()
+
+	def putBatch(batch):
+		if stopStreaming.is_set():
+			return False
+		asyncio.run_coroutine_threadsafe(queue.put(batch), loop).result()
+		return True
+
+	def produceRows():
+		try:
+			batch = [getJobHeader(job)]
+			for row in compareServiceJob(serviceCache, job):
+				batch.append(row)
+				if len(batch) == serviceBatchSize:
+					if not putBatch(batch):
+						return
+					batch = []
+			if putBatch(batch):
+				putBatch(None)
+		except Exception as error:
+			putBatch(error)
+
+	producer = loop.run_in_executor(executor, produceRows)
+	try:
+		writeServiceResponse(writer, "200 OK", "application/x-ndjson")
+		numberOfRows = -1
+		while True:
+			batch = await queue.get()
+			if batch is None:
+				writer.write((json.dumps({"rows": numberOfRows}) + "\n").encode("utf-8"))
+				break
+			if isinstance(batch, Exception):
+				writer.write((json.dumps({"error": str(batch)}) + "\n").encode("utf-8"))
+				break
+			writer.write("".join(json.dumps(row) + "\n" for row in batch).encode("utf-8"))
+			numberOfRows = numberOfRows + len(batch)
+			await writer.drain()
+	finally:
+		stopStreaming.set()
+		while not queue.empty():
+			queue.get_nowait()
+		await producer
+
+def writeServiceWorkbook(serviceCache, job):
+	resultsFilePath = job.get("results_file") or getFullPath(os.path.dirname(job["file1"]), "Results_" + datetime.now().strftime("%Y%m%d_%H%M%S_%f") + ".xlsx")
+	os.makedirs(os.path.dirname(resultsFilePath), exist_ok=True)
+	writeToResultsFile(resultsFilePath, itertools.chain([getJobHeader(job)], compareServiceJob(serviceCache, job)))
+	return resultsFilePath
+
+async def handleServiceRequest(serviceCache, executor, serviceFolder, reader, writer):
+	import asyncio
+	import json
+	try:
+		requestLine = (await reader.readline()).decode("latin-1").split()
+		headers = {}
+		while True:
+			headerLine = await reader.readline()
+			if headerLine in (b"\r\n", b"\n", b""):
+				break
+			headerName, separator, headerValue = headerLine.decode("latin-1").partition(":")
+			headers[headerName.strip().lower()] = headerValue.strip()
+		body = await reader.readexactly(int(headers.get("content-length", 0)))
+		if requestLine[:2] == ["GET", "/status"]:
+			status = {"files": serviceCache.getStatus()}
+			status.update(runProfile.getProfile())
+			writeServiceResponse(writer, "200 OK", "application/json", json.dumps(status).encode("utf-8"))
+		elif requestLine[:2] == ["POST", "/compare"]:
+			try:
+				job = json.loads(body)
+				for fileKey in ("file1", "file2", "results_file"):
+					if job.get(fileKey) is not None and not (isinstance(job[fileKey], str) and os.path.isabs(job[fileKey]) and isInFolder(job[fileKey], serviceFolder)):
+						raise ValueError(fileKey + " must be an absolute path in the folder " + serviceFolder)
+				for fileKey in ("file1", "file2"):
+					if not os.path.isabs(job.get(fileKey) or "") or not bPathExists(job[fileKey]):
+						raise ValueError(fileKey + " must be the absolute path of an existing metadata file")
+			except (ValueError, TypeError, AttributeError) as error:
+				writeServiceResponse(writer, "400 Bad Request", "application/json", json.dumps({"error": str(error)}).encode("utf-8"))
+				return
+			printLines("Comparing " + job["file1"] + " with " + job["file2"])
+			if job.get("format", "jsonl") == "xlsx":
+				try:
+					resultsFilePath = await asyncio.get_running_loop().run_in_executor(executor, writeServiceWorkbook, serviceCache, job)
+				except Exception as error:
+					writeServiceResponse(writer, "500 Internal Server Error", "application/json", json.dumps({"error": str(error)}).encode("utf-8"))
+					return
+				writeServiceResponse(writer, "200 OK", "application/json", json.dumps({"results_file": resultsFilePath}).encode("utf-8"))
+			else:
+				await streamServiceRows(serviceCache, executor, job, writer)
+		else:
+			writeServiceResponse(writer, "404 Not Found", "application/json", json.dumps({"error": "use POST /compare or GET /status"}).encode("utf-8"))
+	except (asyncio.IncompleteReadError, ConnectionError, IndexError, ValueError):
+		pass
+	finally:
+		try:
+			await writer.drain()
+		except ConnectionError:
+			pass
+		writer.close()
+
+def serveComparisons(host, port, serviceFolder, maximumFiles, workers, cacheFolder=None, cacheSize=0):
+	import asyncio
+	from concurrent.futures import ThreadPoolExecutor
+	serviceCache = ServiceCache(maximumFiles, cacheFolder, cacheSize)
+	executor = ThreadPoolExecutor(max_workers=workers)
+
+	async def serve():
+		server = await asyncio.start_server(lambda reader, writer: handleServiceRequest(serviceCache, executor, serviceFolder, reader, writer), host, port)
+		printLines("Comparison service is listening on http://{}:{} for the files in {}".format(host, port, serviceFolder))
+		async with server:
+			await server.serve_forever()
+
+	try:
+		asyncio.run(serve())
+	except KeyboardInterrupt:
+		printLines("Comparison service stopped")
+	finally:
+		executor.shutdown(cancel_futures=True)
+
+def submitComparison(host, port, job):
+	import http.client
+	import json
+	connection = http.client.HTTPConnection(host, port)
+	try:
+		connection.request("POST", "/compare", json.dumps(job), {"Content-Type": "application/json"})
+		response = connection.getresponse()
+		if job["format"] == "xlsx" or response.status != 200:
+			result = json.loads(response.read())
+			if "error" in result:
+				print("ERROR: " + result["error"], file=sys.stderr)
+				return 2
+			print("INFO: {}: Results are in the file: {}" . format(getCurrentTime(), result["results_file"]))
+			return 0
+		for line in response:
+			if line.startswith(b"{") and b'"error"' in line:
+				print("ERROR: " + json.loads(line)["error"], file=sys.stderr)
+				return 2
+			sys.stdout.write(line.decode("utf-8"))
+		return 0
+	finally:
+		connection.close()
+
+'''
+Batch comparison, used with --manifest for the many pairs compared in one run. The manifest is a CSV file with the
+columns file1, file2, path and output, or a JSON list of objects with these keys, path and output can be left empty.
+A relative path is taken from the folder of the manifest and the default path is --path, the files and a relative
+output are taken from the path of the pair, the default output is Results_<time>_<entry>_<file1>_<file2>.xlsx there.
+The pairs are compared in memory like the jobs of --serve, on a pool of --workers processes, so nothing but the results
+files is written to the paths. Every process keeps the files it read in its own ServiceCache and the pairs with the
+same file1 are submitted together as one task, so file1 is read and indexed once for all its pairs, with --cache-folder
+the snapshots are shared by the processes too. An entry which is not valid or a pair which fails is reported and the
+others go on. The results file of the run is an index workbook with a row per entry, its
+status, number of rows and time, and a link to its results file.
+'''
+manifestCache = None
+
+def getManifestJob(entryNumber, error):
+	return {"entry": entryNumber, "path": "", "file1": "", "file2": "", "results_file": "", "error": error}
+
+def readManifest(manifestPath, filePath):
+	import json
+	manifestFolder = os.path.dirname(os.path.abspath(manifestPath))
+	with open(manifestPath, encoding="utf-8-sig", newline="") as manifestFile:
+		if manifestPath.lower().endswith(".json"):
+			entries = json.load(manifestFile)
+		else:
+			entries = list(csv.DictReader(manifestFile))
+	if not isinstance(entries, list):
+		raise Exception("Terminating the program as the manifest " + manifestPath + " is not a list of entries")
+	jobs = []
+	for entryNumber, entry in enumerate(entries, 1):
+		if not isinstance(entry, dict):
+			jobs.append(getManifestJob(entryNumber, "the entry is not an object with file1 and file2"))
+			continue
+		entry = {str(key).strip().lower(): str(value).strip() for key, value in entry.items() if key is not None and value is not None}
+		if not entry.get("file1") or not entry.get("file2"):
+			jobs.append(getManifestJob(entryNumber, "the entry must have file1 and file2"))
+			continue
+		pairPath = os.path.normpath(os.path.join(manifestFolder, entry["path"])) if entry.get("path") else str(filePath)
+		outputFile = entry.get("output") or "Results_{}_{}_{}_{}.xlsx".format(now.strftime("%Y%m%d_%H%M%S"), entryNumber,
+			os.path.basename(entry["file1"]).split(".")[0], os.path.basename(entry["file2"]).split(".")[0])
+		jobs.append({"entry": entryNumber, "path": pairPath, "file1": os.path.abspath(getFullPath(pairPath, entry["file1"])),
+			"file2": os.path.abspath(getFullPath(pairPath, entry["file2"])), "results_file": os.path.abspath(getFullPath(pairPath, outputFile))})
+	return jobs
+
+def compareManifestJob(job, reportReorder, maximumFiles, cacheFolder=None, cacheSize=0):
+	global manifestCache
+	if manifestCache is None:
+		manifestCache = ServiceCache(maximumFiles, cacheFolder, cacheSize)
+	printLines("Comparing {} with {}, entry {} of the manifest".format(job["file1"], job["file2"], job["entry"]))
+	startTime = time.perf_counter()
+	try:
+		os.makedirs(os.path.dirname(job["results_file"]), exist_ok=True)
+		numberOfRows = writeToResultsFile(job["results_file"], itertools.chain([getJobHeader(job)],
+			compareServiceJob(manifestCache, dict(job, report_reorder=reportReorder))))
+	except Exception as error:
+		printWarningLines("Entry {} of the manifest failed: {}".format(job["entry"], error))
+		return {"status": "Failed: " + str(error), "rows": None, "seconds": time.perf_counter() - startTime}
+	return {"status": "Completed", "rows": numberOfRows, "seconds": time.perf_counter() - startTime}
+
+'''
+A group is the pairs of the manifest with the same file1, compared by one process of the pool so that the parsed file1
+is taken from the ServiceCache of that process. The process profiles the group on its own RunProfile, its stages and
+sections are returned with the results and added to the profile of the run.
+'''
+def compareManifestGroup(jobs, reportReorder, maximumFiles, cacheFolder=None, cacheSize=0):
+	global runProfile
+	runProfile = RunProfile()
+	results = [compareManifestJob(job, reportReorder, maximumFiles, cacheFolder, cacheSize) for job in jobs]
+	return results, {"stages": runProfile.stages, "sections": runProfile.sections}
+
+def addWorkerProfile(workerProfile):
+	for stageName, stageProfile in workerProfile["stages"].items():
+		runProfile.addStage(stageName, stageProfile["seconds"], stageProfile["records"])
+	for sectionName, sectionProfile in workerProfile["sections"].items():
+		runProfile.addSection(sectionName, **sectionProfile)
+
+def writeManifestIndex(indexFilePath, jobs, results):
+    from openpyxl import Workbook
+    printLines("creating the index of the results files")
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Index"
+    header = ["Entry", "Path", "File1", "File2", "Status", "Rows", "Seconds", "Results File"]
+    ws.append(header)
+    for cell in ws[1]:
+        cell.font = getFontStyle()
+        cell.fill = getBackGroundColor()
+    indexFolder = os.path.dirname(os.path.abspath(indexFilePath))
+    for job, result in zip(jobs, results):
+        ws.append([job["entry"], job["path"], os.path.basename(job["file1"]), os.path.basename(job["file2"]), result["status"],
+            result["rows"], round(result["seconds"], 2), os.path.basename(job["results_file"]) if result["rows"] is not None else None])
+        if result["rows"] is not None:
+            cell = ws.cell(row=ws.max_row, column=len(header))
+            try:
+                cell.hyperlink = os.path.relpath(job["results_file"], indexFolder)
+            except ValueError:
+                cell.hyperlink = job["results_file"]
+            cell.style = "Hyperlink"
+    wb.save(indexFilePath)
+    printLine("completed ....")
+
+def compareManifest(filePath, manifestPath, indexFilePath, workers, maximumFiles, cacheFolder=None, cacheSize=0, reportReorder=False):
+	jobs = readManifest(manifestPath, filePath)
+	printLines("Comparing {} pairs of the manifest {} on {} workers".format(len(jobs), manifestPath, workers))
+	results = {}
+	validJobs = []
+	for job in jobs:
+		if "error" in job:
+			printWarningLines("Entry {} of the manifest is not valid: {}".format(job["entry"], job["error"]))
+			results[job["entry"]] = {"status": "Failed: " + job["error"], "rows": None, "seconds": 0.0}
+		else:
+			validJobs.append(job)
+	validJobs.sort(key=lambda job: (job["file1"], job["file2"]))
+	groups = [list(group) for file1, group in itertools.groupby(validJobs, key=lambda job: job["file1"])]
+	if workers > 1 and len(groups) > 1:
+		from concurrent.futures import ProcessPoolExecutor
+		with ProcessPoolExecutor(max_workers=workers) as executor:
+			futures = [(group, executor.submit(compareManifestGroup, group, reportReorder, maximumFiles, cacheFolder, cacheSize)) for group in groups]
+			for group, future in futures:
+				try:
+					groupResults, workerProfile = future.result()
+				except Exception as error:
+					printWarningLines("Entries {} of the manifest failed: {}".format(", ".join(str(job["entry"]) for job in group), error))
+					groupResults = [{"status": "Failed: " + str(error), "rows": None, "seconds": 0.0} for job in group]
+				else:
+					addWorkerProfile(workerProfile)
+				for job, result in zip(group, groupResults):
+					results[job["entry"]] = result
+	else:
+		for job in validJobs:
+			results[job["entry"]] = compareManifestJob(job, reportReorder, maximumFiles, cacheFolder, cacheSize)
+	results = [results[job["entry"]] for job in jobs]
+	writeManifestIndex(indexFilePath, jobs, results)
+	numberOfFailures = sum(1 for result in results if result["rows"] is None)
+	if numberOfFailures:
+		printWarningLines("{} of the {} pairs of the manifest failed, see the index {}".format(numberOfFailures, len(jobs), indexFilePath))
 
 def process():
 	startTime = time.time()
@@ -450,25 +2127,151 @@ def process():
     , default = 'ABTPROD_Metadata.app')
 	optional.add_argument('-p', '--path', help='Provide the path to the metadata files, if path is not provided\
 	then this program will try to check for the files in the current working directory', default ='')
+	optional.add_argument('-t', '--targets', help='Compare file1 as the baseline against each of these metadata files in\
+	one run and write one results file with a column per file, file2 is not used', nargs='+', default=[])
+	optional.add_argument('-m', '--in-memory', help='Compare the files in memory, no temporary files are written\
+	to the path, only the results file', action='store_true')
+	optional.add_argument('-w', '--workers', help='Number of processes used to compare the sections in parallel,\
+	the files are compared in memory when more than one worker is used and the files bigger than 4 MB are read in\
+	chunks on the workers when the machine has more than one CPU. default is 1', type=int, default=1)
+	optional.add_argument('--cache-folder', help='Folder of the snapshot cache of the in-memory modes, the sections read\
+	from a metadata file are saved there and reused while the file is unchanged. The cache is only used when this is\
+	given, by default nothing is written but the results', default=None)
+	optional.add_argument('--cache-size', help='Size limit of the snapshot cache in MB, the least recently used snapshots\
+	are deleted beyond it. default is 1024', type=int, default=1024)
+	optional.add_argument('--database', help='Write the results to this SQLite database instead of the excel file, every\
+	run is added to the database with its differences', default=None)
+	optional.add_argument('--serve', help='Start the comparison service on --port, it keeps the metadata files it read\
+	in memory and compares the jobs posted by --submit, only the files in --path are served', action='store_true')
+	optional.add_argument('--submit', help='Submit file1 and file2 to the comparison service on --port, the rows are\
+	printed as JSON lines, or the path of the results file with --format xlsx', action='store_true')
+	optional.add_argument('--host', help='Host of the comparison service. default is 127.0.0.1', default='127.0.0.1')
+	optional.add_argument('--port', help='Port of the comparison service. default is 8765', type=int, default=8765)
+	optional.add_argument('--format', help='Output of --submit, jsonl or xlsx. default is jsonl', choices=['jsonl', 'xlsx'], default='jsonl')
+	optional.add_argument('--service-cache', help='Number of metadata files kept in memory by --serve and --manifest. default is 8', type=int, default=8)
+	optional.add_argument('--manifest', help='Compare every pair of files listed in this CSV or JSON manifest, with the\
+	columns file1, file2, path and output, on a pool of --workers processes and write an index of the results files',
+	default=None)
+	optional.add_argument('--check', help='Only check whether the files differ, the sections which differ are printed and\
+	the exit code is 1 when any section differs, 2 when a file cannot be read and 0 otherwise, no results file is\
+	written', action='store_true')
+	optional.add_argument('-x', '--external', help='Compare the files with an external sort-merge for metadata larger\
+	than the memory, the sections are spilled as sorted runs to a temporary folder', action='store_true')
+	optional.add_argument('--memory-budget', help='Memory in MB used for the lines and rows held by --external before\
+	they are spilled to disk. default is 256', type=int, default=256)
+	optional.add_argument('--temp-folder', help='Folder of the sorted runs of --external. default is the temporary folder\
+	of the system', default=None)
+	optional.add_argument('--state', help='State file of the incremental comparison, the fingerprints and the\
+	differences of every section are saved there and the sections which did not change since the last run are not\
+	compared again, the files are compared in memory', default=None)
+	optional.add_argument('--report-reorder', help='Report the members and hierarchy lines which are in both files\
+	but at a different place in the section with an Order row and their positions', action='store_true')
+	optional.add_argument('--profile', help='Run the comparison under cProfile, the statistics are saved next to the\
+	results file with the .prof extension and the slowest functions are printed', action='store_true')
+	optional.add_argument('--tracemalloc', help='Trace the memory allocations of the comparison, the peak and the biggest\
+	allocations are added to the run profile', action='store_true')
 	
 	args = vars(parser.parse_args())
-	global listOfCustDimensions
 	global differencesfilePath 
+	global resultsDatabasePath
+	resultsDatabasePath = args["database"]
+	if args["external"] and (args["targets"] or args["report_reorder"]):
+		parser.error("--external cannot be used with --targets or --report-reorder")
+	if args["manifest"] and (args["targets"] or args["external"] or args["database"]):
+		parser.error("--manifest cannot be used with --targets, --external or --database")
+	if args["state"] and (args["targets"] or args["external"] or args["manifest"]):
+		parser.error("--state cannot be used with --targets, --external or --manifest")
 	
 	if args["path"] == "":
-		args["path"] = Path.cwd()
+		args["path"] = os.getcwd()
 	differencesfilePath = getFullPath(args["path"],"Results_" + now.strftime("%Y%m%d_%H%M%S") + ".csv")
 	
-	if args["file1"] == "" or args["file2"] == "" :
+	if args["serve"]:
+		serveComparisons(args["host"], args["port"], os.path.realpath(args["path"]), args["service_cache"], max(args["workers"], 4),
+			args["cache_folder"], args["cache_size"] * 1024 * 1024)
+		return
+	if (args["file1"] == "" or args["file2"] == "") and not args["manifest"]:
 		raise Exception("Terminating the program as Two metadata files are not provided")
+	if args["submit"]:
+		sys.exit(submitComparison(args["host"], args["port"], {"file1": os.path.abspath(getFullPath(args["path"], args["file1"])),
+			"file2": os.path.abspath(getFullPath(args["path"], args["file2"])), "format": args["format"], "report_reorder": args["report_reorder"]}))
+	if args["check"]:
+		sys.exit(checkMetadataFiles(args["path"], args["file1"], args["targets"] or [args["file2"]]))
+	if args["profile"]:
+		import cProfile
+		profiler = cProfile.Profile()
+		profiler.enable()
+	if args["tracemalloc"]:
+		import tracemalloc
+		tracemalloc.start()
+	compareMetadataFiles(args, startTime)
+	if args["profile"]:
+		profiler.disable()
+	runDetails = {"file1": args["file1"], "file2": None if args["targets"] else args["file2"], "targets": args["targets"],
+		"mode": "manifest" if args["manifest"] else "targets" if args["targets"] else "external" if args["external"] else "in-memory" if args["in_memory"] or args["workers"] > 1 or args["state"] else "disk",
+		"manifest": args["manifest"], "workers": args["workers"], "results_file": str(excelFilePath), "started": now.isoformat(timespec="seconds")}
+	if stateChanges is not None:
+		runDetails["sections_since_last_run"] = stateChanges
+	if args["tracemalloc"]:
+		snapshot = tracemalloc.take_snapshot()
+		runDetails["tracemalloc"] = {"peak_mb": round(tracemalloc.get_traced_memory()[1] / 1048576, 1),
+			"top_allocations": [{"location": str(statistic.traceback), "size_kb": round(statistic.size / 1024, 1), "count": statistic.count}
+				for statistic in snapshot.statistics("lineno")[:10]]}
+		tracemalloc.stop()
+	profilePath = os.path.splitext(differencesfilePath)[0] + "_profile.json"
+	profile = runProfile.writeProfile(profilePath, runDetails)
+	printLines("Run profile is in the file: " + profilePath)
+	runProfile.printSummary(profile)
+	if args["profile"]:
+		statisticsPath = os.path.splitext(differencesfilePath)[0] + ".prof"
+		profiler.dump_stats(statisticsPath)
+		printLines("cProfile statistics are in the file: " + statisticsPath)
+		import pstats
+		pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
+
+'''
+The comparison of the files in one of the three modes, the run profile is written by process once it returns.
+'''
+def compareMetadataFiles(args, startTime):
+	global listOfCustDimensions
+	global excelFilePath
 	#listOfCustDimensions = numberOfCustomDimensions(args["path"], [args["file1"], args["file2"]])
+	header = ["Dimension", "Member Name", "Property", args["file1"].split(".")[0], args["file2"].split(".")[0]]
+	cacheFolder = args["cache_folder"]
+	if args["manifest"]:
+		excelFilePath = getResultsFilePath()
+		compareManifest(args["path"], args["manifest"], excelFilePath, args["workers"], args["service_cache"], cacheFolder, args["cache_size"] * 1024 * 1024, args["report_reorder"])
+		print("INFO: {}: Results are in the file: {}" . format(getCurrentTime(), excelFilePath))
+		print("INFO: {}: processing completed in: {} secs" . format(getCurrentTime(), str(round(time.time() - startTime, 2))))
+		return
+	if args["targets"]:
+		excelFilePath = getResultsFilePath()
+		header = header[:4] + [targetFile.split(".")[0] for targetFile in args["targets"]]
+		writeResults(excelFilePath, itertools.chain([header], compareTargets(args["path"], args["file1"], args["targets"], cacheFolder, args["cache_size"] * 1024 * 1024, args["report_reorder"])), "targets")
+		print("INFO: {}: Results are in the file: {}" . format(getCurrentTime(), excelFilePath))
+		print("INFO: {}: processing completed in: {} secs" . format(getCurrentTime(), str(round(time.time() - startTime, 2))))
+		return
+	if args["external"]:
+		excelFilePath = getResultsFilePath()
+		writeResults(excelFilePath, itertools.chain([header], compareExternal(args["path"], [args["file1"], args["file2"]], args["memory_budget"] * 1024 * 1024, args["temp_folder"])), "external")
+		print("INFO: {}: Results are in the file: {}" . format(getCurrentTime(), excelFilePath))
+		print("INFO: {}: processing completed in: {} secs" . format(getCurrentTime(), str(round(time.time() - startTime, 2))))
+		return
+	if args["in_memory"] or args["workers"] > 1 or args["state"]:
+		excelFilePath = getResultsFilePath()
+		writeResults(excelFilePath, itertools.chain([header], compareInMemory(args["path"], [args["file1"], args["file2"]], args["workers"], cacheFolder,
+			args["cache_size"] * 1024 * 1024, args["report_reorder"], args["state"])), "in-memory")
+		print("INFO: {}: Results are in the file: {}" . format(getCurrentTime(), excelFilePath))
+		print("INFO: {}: processing completed in: {} secs" . format(getCurrentTime(), str(round(time.time() - startTime, 2))))
+		return
+	listOfCustDimensions = getCustomOrder(getFullPath(args["path"], args["file1"]))
 	processFolder = createTempFolders(args["path"], args["file1"].split(".")[0], args["file2"].split(".")[0])
 	trimMetadataFiles(args["path"], [args["file1"], args["file2"]])
 	aDimensionsInFiles = splitFile(args["path"], [args["file1"], args["file2"]])
 	
 	with open(differencesfilePath, "a", encoding="cp1252", newline="") as outputCSVFile:
 		CSVWriter = csv.writer(outputCSVFile)
-		CSVWriter.writerow(["Dimension", "Member Name", "Property", args["file1"].split(".")[0], args["file2"].split(".")[0]])
+		CSVWriter.writerow(header)
 	count = 0
 	for eachDimensionsFile in aDimensionsInFiles:
 		count = count + 1
@@ -476,7 +2279,7 @@ def process():
 			
 			if count == 1:
 				if fileInMetadatOne in aDimensionsInFiles[1]:
-					findDifferences(getFullPath(args["path"],"Dimension_files"), args["file1"].split(".")[0], args["file2"].split(".")[0], fileInMetadatOne + ".txt")
+					findDifferences(getFullPath(args["path"],"Dimension_files"), args["file1"].split(".")[0], args["file2"].split(".")[0], fileInMetadatOne + ".txt", args["report_reorder"])
 				else:
 					printWarningLines(processBlock(fileInMetadatOne) + " doesn't exists in " + args["file2"] + "... therefore skipping the comparison")
 			else:
@@ -485,6 +2288,7 @@ def process():
                 
 	createResultsFile(differencesfilePath)
 	printLines("Deleting the temporary files and directories")
+	import shutil
 	shutil.rmtree(getFullPath(args["path"], "Dimension_files"), ignore_errors=False, onerror=None)
 	os.remove(getFullPath(args["path"],args["file1"].split(".")[0]+"_v1.txt"))
 	os.remove(getFullPath(args["path"],args["file2"].split(".")[0]+"_v1.txt"))	
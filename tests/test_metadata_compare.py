@@ -0,0 +1,435 @@
+'''
+Tests of Metadata_Compare8.py. Every test writes a small pair of metadata files to a temporary folder and runs the
+script on them the way it is run from the command line, the rows are read back from the results workbook.
+'''
+import bz2
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import gzip
+import http.client
+import importlib
+import json
+import lzma
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+import zipfile
+
+import openpyxl
+import pytest
+
+
+scriptPath = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Metadata_Compare8.py")
+
+metadataText1 = """!FILE_FORMAT=11.12
+!VERSION=11.1.6100
+!CUSTOM_ORDER=Custom1;Custom2;Custom3;Custom4
+
+!APPLICATION_SETTINGS
+DefaultCurrency=USD
+DefaultRateForBalanceAccounts=EOM
+!CURRENCIES
+USD;0;;N;English=USD money
+EUR;0;;N;English=EUR money
+!MEMBERS=Account
+Acc001;REVENUE;N;Y;N;;[None];[None];[None];[None];2;N;Y;Y;Y;Y;;;;;;[ICP Top];N;;1;DefaultParent=#root;English=Account 1
+Acc002 ; REVENUE ; N ; Y ; N ;  ; [None] ; [None] ; [None] ; [None] ; 2 ; N ; Y ; Y ; Y ; Y ;  ;  ;  ;  ;  ; [ICP Top] ; N ;  ; 1 ; DefaultParent=Acc001 ; English=Account 2
+Acc003;REVENUE;N;Y;N;;[None];[None];[None];[None];2;N;Y;Y;Y;Y;;;;;;[ICP Top];N;;1;DefaultParent=Acc001;English=Account 3
+Acc004;EXPENSE;N;Y;N;;[None];[None];[None];[None];2;N;Y;Y;Y;Y;;;;;;[ICP Top];N;;1;DefaultParent=Acc001;English=Account 4
+!HIERARCHIES=Account
+;Acc001
+Acc001;Acc002;1
+Acc001;Acc003;1
+Acc001;Acc004;1
+!MEMBERS=Entity
+Ent001;USD;Y;N;N;;;;;;;DefaultParent=#root;English=Entity 1
+Ent002;USD;Y;N;N;;;;;;;DefaultParent=Ent001;English=Entity 2
+Ent003;USD;Y;N;N;;;;;;;DefaultParent=Ent001;English=Entity 3
+!HIERARCHIES=Entity
+;Ent001
+Ent001;Ent002
+Ent001;Ent003
+!MEMBERS=Custom1
+C001;N;N;N;;;;;1;DefaultParent=#root;English=C1
+C002;N;N;N;;;;;1;DefaultParent=#root;English=C2
+!CONSOLIDATION_METHODS
+M1;N;N;0;0;100;Proportional;English=M1
+"""
+
+metadataText2 = """!FILE_FORMAT=11.12
+!VERSION=11.1.6100
+!CUSTOM_ORDER=Custom1;Custom2;Custom3;Custom4
+
+!APPLICATION_SETTINGS
+DefaultCurrency=USD
+DefaultRateForBalanceAccounts=AVG
+!CURRENCIES
+USD;0;;N;English=USD money
+GBP;0;;N;English=GBP money
+!MEMBERS=Account
+Acc001;REVENUE;N;Y;N;;[None];[None];[None];[None];2;N;Y;Y;Y;Y;;;;;;[ICP Top];N;;1;DefaultParent=#root;English=Account 1
+Acc002;REVENUE;N;Y;N;;[None];[None];[None];[None];2;N;Y;Y;Y;Y;;;;;;[ICP Top];N;;1;DefaultParent=Acc001;English=Account two
+Acc003;EXPENSE;N;Y;N;;[None];[None];[None];[None];2;N;Y;Y;Y;Y;;;;;;[ICP Top];N;;1;DefaultParent=Acc001;English=Account 3
+Acc004;EXPENSE;N;Y;N;;[None];[None];[None];[None];2;N;Y;Y;Y;Y;;;;;;[ICP Top];N;;1;DefaultParent=Acc002;English=Account 4
+Acc005;EXPENSE;N;Y;N;;[None];[None];[None];[None];2;N;Y;Y;Y;Y;;;;;;[ICP Top];N;;1;DefaultParent=Acc001;English=Account 5
+!HIERARCHIES=Account
+;Acc001
+Acc001;Acc002;1
+Acc001;Acc003;0
+Acc002;Acc004;1
+Acc001;Acc005;1
+!MEMBERS=Entity
+Ent001;USD;Y;N;N;;;;;;;DefaultParent=#root;English=Entity 1
+Ent002;EUR;Y;N;N;;;;;;;DefaultParent=Ent001;English=Entity 2
+!HIERARCHIES=Entity
+;Ent001
+Ent001;Ent002
+!MEMBERS=Custom1
+C001;N;N;N;;;;;1;DefaultParent=#root;English=C1
+C002;N;N;N;;;;;1;DefaultParent=#root;English=C2
+!CONSOLIDATION_METHODS
+M1;N;N;0;0;100;Proportional;English=M1
+"""
+
+def writeMetadataFile(folder, fileName, text):
+	with open(os.path.join(str(folder), fileName), "w", encoding="cp1252", newline="\r\n") as metadataFile:
+		metadataFile.write(text)
+	return os.path.join(str(folder), fileName)
+
+def writeMetadataPair(folder):
+	os.makedirs(str(folder), exist_ok=True)
+	writeMetadataFile(folder, "QA.app", metadataText1)
+	writeMetadataFile(folder, "PROD.app", metadataText2)
+	return folder
+
+def runScript(folder, *arguments):
+	return subprocess.run([sys.executable, scriptPath, "-p", str(folder)] + list(arguments), stdout=subprocess.PIPE,
+		stderr=subprocess.STDOUT, universal_newlines=True, timeout=600)
+
+def readResultRows(resultsFilePath):
+	workbook = openpyxl.load_workbook(resultsFilePath, read_only=True)
+	try:
+		rows = []
+		for sheet in workbook.worksheets:
+			for rowNumber, row in enumerate(sheet.iter_rows(values_only=True)):
+				if rowNumber == 0 and rows:
+					continue
+				cells = ["" if value is None else str(value).strip() for value in row]
+				while cells and cells[-1] == "":
+					cells.pop()
+				rows.append(cells)
+		return rows
+	finally:
+		workbook.close()
+
+def getResultRows(folder, *arguments):
+	for resultsFilePath in glob.glob(os.path.join(str(folder), "Results_*")):
+		os.remove(resultsFilePath)
+	process = runScript(folder, *arguments)
+	assert process.returncode == 0, process.stdout
+	resultsFiles = glob.glob(os.path.join(str(folder), "Results_*.xlsx"))
+	assert len(resultsFiles) == 1, process.stdout
+	return readResultRows(resultsFiles[0])
+
+def compareFiles(folder, *options):
+	return getResultRows(folder, "-f1", "QA.app", "-f2", "PROD.app", *options)
+
+def getRunProfile(folder):
+	with open(glob.glob(os.path.join(str(folder), "Results_*_profile.json"))[0]) as profileFile:
+		return json.load(profileFile)
+
+@pytest.fixture
+def diskRows(tmp_path):
+	rows = compareFiles(writeMetadataPair(tmp_path / "disk"))
+	assert rows[0] == ["Dimension", "Member Name", "Property", "QA", "PROD"]
+	assert len(rows) > 10
+	return rows
+
+@pytest.mark.parametrize("options", [["-m"], ["-w", "2"], ["-x"], ["-x", "--memory-budget", "0"]])
+def test_modes_give_the_rows_of_the_disk_mode(tmp_path, diskRows, options):
+	folder = writeMetadataPair(tmp_path / "mode")
+	assert compareFiles(folder, *options) == diskRows
+
+def test_in_memory_mode_writes_only_the_results(tmp_path):
+	folder = writeMetadataPair(tmp_path / "mode")
+	compareFiles(folder, "-m")
+	assert sorted(name for name in os.listdir(str(folder)) if not name.startswith("Results_")) == ["PROD.app", "QA.app"]
+
+def test_snapshot_cache_is_used_only_with_a_cache_folder(tmp_path, monkeypatch, diskRows):
+	folder = writeMetadataPair(tmp_path / "mode")
+	homeFolder = tmp_path / "home"
+	homeFolder.mkdir()
+	monkeypatch.setenv("HOME", str(homeFolder))
+	cacheFolder = tmp_path / "cache"
+	compareFiles(folder, "-m")
+	assert os.listdir(str(homeFolder)) == []
+	assert compareFiles(folder, "-m", "--cache-folder", str(cacheFolder)) == diskRows
+	assert len(glob.glob(os.path.join(str(cacheFolder), "*.snapshot"))) == 2
+	assert compareFiles(folder, "-m", "--cache-folder", str(cacheFolder)) == diskRows
+
+def test_targets_keep_repeated_rows_of_a_target(tmp_path):
+	header = "!CUSTOM_ORDER=Custom1;Custom2;Custom3;Custom4\n!CURRENCIES\n"
+	writeMetadataFile(tmp_path, "BASE.app", header + 3 * "USD;0;;N;English=USD money\n" + "EUR;0;;N;English=EUR money\n")
+	writeMetadataFile(tmp_path, "T1.app", header + "USD;0;;N;English=USD money\nEUR;0;;N;English=EUR money\n")
+	writeMetadataFile(tmp_path, "T2.app", header + 2 * "USD;0;;N;English=USD money\n" + "EUR;0;;N;English=EUR money\n")
+	assert getResultRows(tmp_path, "-f1", "BASE.app", "-t", "T1.app", "T2.app") == [
+		["Dimension", "Member Name", "Property", "BASE", "T1", "T2"],
+		["CURRENCIE", "USD", "", "", "Missing", "Missing"],
+		["CURRENCIE", "USD", "", "", "Missing"]]
+
+hierarchyText1 = """!CUSTOM_ORDER=Custom1;Custom2;Custom3;Custom4
+!HIERARCHIES=Account
+;A1
+A1;A2;1
+P1;S1
+P2;S1
+Q1;M1
+R1;W1;1
+"""
+
+hierarchyText2 = """!CUSTOM_ORDER=Custom1;Custom2;Custom3;Custom4
+!HIERARCHIES=Account
+;A1
+a1;A2;1
+P1;S1
+P3;S1
+Q2;M1
+R1;W1;2
+"""
+
+@pytest.mark.parametrize("options", [[], ["-m"], ["-x"]])
+def test_moved_rows_only_for_children_with_one_parent(tmp_path, options):
+	writeMetadataFile(tmp_path, "QA.app", hierarchyText1)
+	writeMetadataFile(tmp_path, "PROD.app", hierarchyText2)
+	assert compareFiles(tmp_path, *options) == [
+		["Dimension", "Member Name", "Property", "QA", "PROD"],
+		["Account", "A2", "Case", "A1;A2", "a1;A2"],
+		["Account", "P2;S1", "Hierarchy", "", "Missing"],
+		["Account", "M1", "Moved", "Q1", "Q2"],
+		["Account", "R1;W1", "aggrweight", "1", "2"],
+		["Account", "P3;S1", "Hierarchy", "Missing"]]
+
+def test_check_exit_codes(tmp_path):
+	writeMetadataPair(tmp_path)
+	writeMetadataFile(tmp_path, "QA_spaces.app", metadataText1.replace(";", " ; "))
+	writeMetadataFile(tmp_path, "QA_nbsp.app", metadataText1.replace("N;", "N\xa0;"))
+	for trimmedFile in ["QA_spaces.app", "QA_nbsp.app"]:
+		process = runScript(tmp_path, "--check", "-f1", "QA.app", "-f2", trimmedFile)
+		assert process.returncode == 0, process.stdout
+	process = runScript(tmp_path, "--check", "-f1", "QA.app", "-f2", "PROD.app")
+	assert process.returncode == 1, process.stdout
+	assert "Account" in process.stdout and "Custom1" not in process.stdout
+	assert sorted(os.listdir(str(tmp_path))) == ["PROD.app", "QA.app", "QA_nbsp.app", "QA_spaces.app"]
+	with open(os.path.join(str(tmp_path), "PROD.app.gz"), "wb") as brokenFile:
+		brokenFile.write(gzip.compress(metadataText2.encode("cp1252"))[:100])
+	for unreadableFile in ["UAT.app", "PROD.app.gz"]:
+		process = runScript(tmp_path, "--check", "-f1", "QA.app", "-f2", unreadableFile)
+		assert process.returncode == 2, process.stdout
+		assert "Traceback" not in process.stdout
+
+def compressMetadataFile(metadataFilePath, compression):
+	with open(metadataFilePath, "rb") as metadataFile:
+		content = metadataFile.read()
+	os.remove(metadataFilePath)
+	if compression == "zip":
+		with zipfile.ZipFile(metadataFilePath + ".zip", "w", zipfile.ZIP_DEFLATED) as zipFile:
+			zipFile.writestr(os.path.basename(metadataFilePath), content)
+		return metadataFilePath + ".zip"
+	compressedFilePath = metadataFilePath + {"gzip": ".gz", "bz2": ".bz2", "xz": ".xz"}[compression]
+	with {"gzip": gzip, "bz2": bz2, "xz": lzma}[compression].open(compressedFilePath, "wb") as compressedFile:
+		compressedFile.write(content)
+	return compressedFilePath
+
+@pytest.mark.parametrize("compression", ["gzip", "bz2", "xz", "zip"])
+def test_compressed_files_give_the_rows_of_the_plain_files(tmp_path, diskRows, compression):
+	folder = writeMetadataPair(tmp_path / "compressed")
+	fileName2 = os.path.basename(compressMetadataFile(os.path.join(str(folder), "PROD.app"), compression))
+	for options in [[], ["-m"]]:
+		assert getResultRows(folder, "-f1", "QA.app", "-f2", fileName2, *options) == diskRows
+	writeMetadataFile(folder, "PROD.app", metadataText2)
+	process = runScript(folder, "--check", "-f1", "PROD.app", "-f2", fileName2)
+	assert process.returncode == 0, process.stdout
+
+@pytest.mark.parametrize("workers", ["1", "2"])
+def test_manifest_marks_the_invalid_entries_as_failed(tmp_path, diskRows, workers):
+	folder = writeMetadataPair(tmp_path / "manifest")
+	with open(os.path.join(str(folder), "manifest.json"), "w") as manifestFile:
+		json.dump([{"file1": "QA.app", "file2": "PROD.app", "output": "pairs/QA_PROD.xlsx"},
+			{"file1": "QA.app"},
+			"QA.app;PROD.app",
+			{"file1": "QA.app", "file2": "UAT.app", "output": "pairs/QA_UAT.xlsx"},
+			{"file1": "PROD.app", "file2": "QA.app", "output": "pairs/PROD_QA.xlsx"}], manifestFile)
+	indexRows = getResultRows(folder, "--manifest", os.path.join(str(folder), "manifest.json"), "-w", workers)
+	assert indexRows[0] == ["Entry", "Path", "File1", "File2", "Status", "Rows", "Seconds", "Results File"]
+	statuses = {int(row[0]): row[4] for row in indexRows[1:]}
+	assert statuses[1] == "Completed" and statuses[5] == "Completed"
+	assert indexRows[1][5] == str(len(diskRows) - 1)
+	assert statuses[2] == "Failed: the entry must have file1 and file2"
+	assert statuses[3] == "Failed: the entry is not an object with file1 and file2"
+	assert statuses[4].startswith("Failed: ")
+	assert readResultRows(os.path.join(str(folder), "pairs", "QA_PROD.xlsx")) == diskRows
+	assert not os.path.exists(os.path.join(str(folder), "pairs", "QA_UAT.xlsx"))
+	profile = getRunProfile(folder)
+	assert profile["stages"]["diff"]["records"] > 0 and "EntityM" in profile["sections"]
+
+def test_state_reuses_the_unchanged_sections(tmp_path, diskRows):
+	folder = writeMetadataPair(tmp_path / "state")
+	statePath = str(tmp_path / "compare.state")
+	assert compareFiles(folder, "--state", statePath) == diskRows
+	assert compareFiles(folder, "--state", statePath) == diskRows
+	sections = getRunProfile(folder)["sections"]
+	assert sections and all(section.get("reused") == 1 for section in sections.values())
+	writeMetadataFile(folder, "PROD.app", metadataText2.replace("English=Entity 2", "English=Entity two"))
+	changedRows = compareFiles(folder, "--state", statePath)
+	assert [section for section, profile in getRunProfile(folder)["sections"].items() if not profile.get("reused")] == ["EntityM"]
+	assert changedRows == compareFiles(folder, "-m")
+	assert ["Entity", "Ent002", "Descriptions", "English=Entity 2", "English=Entity two"] in changedRows
+
+@pytest.fixture
+def metadataCompare(monkeypatch):
+	monkeypatch.syspath_prepend(os.path.dirname(scriptPath))
+	return importlib.import_module("Metadata_Compare8")
+
+def test_chunked_read_gives_the_sections_of_the_serial_read(tmp_path, monkeypatch, metadataCompare):
+	metadataLines = ["!FILE_FORMAT=11.12", "!MEMBERS=Entity"]
+	metadataLines.extend("Ent{:03};;N;N;N;;;;;;;;English=Entity {}".format(number, number % 7) for number in range(120))
+	metadataLines.extend(["!HIERARCHIES=Entity", ";Ent000"])
+	metadataLines.extend("Ent000;Ent{:03};1".format(number) for number in range(1, 120))
+	metadataLines.extend(["!MEMBERS=Custom1", "C1;N;N;N", "!MEMBERS=Custom2", "C2;N;N;N"])
+	metadataBytes = "\r\n".join(metadataLines).encode("cp1252").replace(b"Ent005;;N", b"Ent005 ; ; N")
+	metadataBytes = metadataBytes.replace(b"\r\nEnt000;Ent050;1\r\n", b"\rEnt000;Ent050;1\r\n")
+	metadataFilePath = str(tmp_path / "Chunked.app")
+	with open(metadataFilePath, "wb") as metadataFile:
+		metadataFile.write(metadataBytes)
+	serialSections = metadataCompare.readSections(metadataFilePath)
+	assert "Ent000;Ent050;1" in serialSections["EntityH"] and "Ent005;;N;N;N;;;;;;;;English=Entity 5" in serialSections["EntityM"]
+	headersOnBoundaries = 0
+	with ProcessPoolExecutor(max_workers=2) as executor:
+		for chunkSize in range(16, 400, 13):
+			monkeypatch.setattr(metadataCompare, "parseChunkSize", chunkSize)
+			chunkRanges = metadataCompare.getChunkRanges(metadataFilePath, chunkSize)
+			headersOnBoundaries = headersOnBoundaries + sum(1 for start, end in chunkRanges if metadataBytes[start:start + 1] == b"!")
+			sectionIndexes = {}
+			assert metadataCompare.readSectionsInChunks(metadataFilePath, executor, sectionIndexes) == serialSections
+			assert "EntityM" in sectionIndexes and "Custom2M" not in sectionIndexes
+			for sectionName, sectionIndex in sectionIndexes.items():
+				serialIndex = metadataCompare.indexBaselineSection(serialSections[sectionName])
+				assert sectionIndex["counts"] == serialIndex["counts"] and sectionIndex["positions"] == serialIndex["positions"]
+				assert sorted(sectionIndex["duplicates"]) == sorted(serialIndex["duplicates"])
+	assert headersOnBoundaries > 0
+
+def getFreePort():
+	with socket.socket() as freeSocket:
+		freeSocket.bind(("127.0.0.1", 0))
+		return freeSocket.getsockname()[1]
+
+def postServiceJob(port, job):
+	connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+	try:
+		connection.request("POST", "/compare", json.dumps(job), {"Content-Type": "application/json"})
+		response = connection.getresponse()
+		return response.status, json.loads(response.read())
+	finally:
+		connection.close()
+
+def test_service_gives_the_rows_of_the_disk_mode(tmp_path, diskRows):
+	folder = writeMetadataPair(tmp_path / "service")
+	port = getFreePort()
+	service = subprocess.Popen([sys.executable, scriptPath, "-p", str(folder), "--serve", "--port", str(port)],
+		stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+	try:
+		for attempt in range(300):
+			assert service.poll() is None
+			try:
+				socket.create_connection(("127.0.0.1", port), timeout=1).close()
+				break
+			except OSError:
+				time.sleep(0.1)
+		submitted = subprocess.run([sys.executable, scriptPath, "-p", str(folder), "-f1", "QA.app", "-f2", "PROD.app", "--submit",
+			"--port", str(port)], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, timeout=600)
+		assert submitted.returncode == 0, submitted.stderr
+		jsonLines = [json.loads(line) for line in submitted.stdout.splitlines()]
+		assert jsonLines[-1] == {"rows": len(diskRows) - 1}
+		submittedRows = []
+		for row in jsonLines[:-1]:
+			cells = ["" if value is None else str(value).strip() for value in row]
+			while cells and cells[-1] == "":
+				cells.pop()
+			submittedRows.append(cells)
+		assert submittedRows == diskRows
+		status, result = postServiceJob(port, {"file1": str(writeMetadataFile(tmp_path, "Outside.app", metadataText1)),
+			"file2": os.path.join(str(folder), "PROD.app")})
+		assert status == 400 and "file1" in result["error"]
+		resultsFilePath = os.path.join(str(folder), "new", "Results.xlsx")
+		status, result = postServiceJob(port, {"file1": os.path.join(str(folder), "QA.app"), "file2": os.path.join(str(folder), "PROD.app"),
+			"format": "xlsx", "results_file": resultsFilePath})
+		assert status == 200 and result["results_file"] == resultsFilePath
+		assert readResultRows(resultsFilePath) == diskRows
+	finally:
+		service.terminate()
+		service.wait(timeout=60)
+
+def readDatabase(databasePath, query):
+	connection = sqlite3.connect(databasePath)
+	try:
+		return connection.execute(query).fetchall()
+	finally:
+		connection.close()
+
+def test_database_gets_the_rows_of_the_workbook(tmp_path, diskRows):
+	folder = writeMetadataPair(tmp_path / "database")
+	writeMetadataFile(folder, "UAT.app", metadataText1.replace("English=Account 3", "English=Account three"))
+	databasePath = str(tmp_path / "results.db")
+	assert runScript(folder, "-f1", "QA.app", "-f2", "PROD.app", "--database", databasePath).returncode == 0
+	assert readDatabase(databasePath, "SELECT run_id, file1, targets, mode, rows FROM runs") == [(1, "QA", "PROD", "disk", len(diskRows) - 1)]
+	assert readDatabase(databasePath, "SELECT COUNT(*) FROM differences WHERE run_id = 1") == [(len(diskRows) - 1,)]
+	indexNames = [name for name, in readDatabase(databasePath, "SELECT name FROM sqlite_master WHERE type = 'index'")]
+	assert {"differences_dimension", "differences_member", "differences_property"} <= set(indexNames)
+	targetRows = getResultRows(folder, "-f1", "QA.app", "-t", "PROD.app", "UAT.app")
+	assert runScript(folder, "-f1", "QA.app", "-t", "PROD.app", "UAT.app", "--database", databasePath).returncode == 0
+	assert readDatabase(databasePath, "SELECT file1, targets, mode, rows FROM runs WHERE run_id = 2") == [("QA", "PROD;UAT", "targets", len(targetRows) - 1)]
+	expectedDifferences = []
+	for row in targetRows[1:]:
+		row = row + (6 - len(row)) * [""]
+		expectedDifferences.extend((row[0], row[1], row[2], target, row[3], row[4 + targetNumber])
+			for targetNumber, target in enumerate(["PROD", "UAT"]) if row[4 + targetNumber] != row[3])
+	databaseDifferences = readDatabase(databasePath, "SELECT dimension, member, property, file2, file1_value, COALESCE(file2_value, '') FROM differences WHERE run_id = 2")
+	assert sorted(databaseDifferences) == sorted(expectedDifferences)
+	assert ("Account", "Acc003", "Descriptions", "UAT", "English=Account 3", "English=Account three") in databaseDifferences
+
+@pytest.mark.parametrize("options", [[], ["-m"], ["-w", "2"]])
+def test_order_rows_have_the_same_cells_in_every_mode(tmp_path, options):
+	folder = writeMetadataPair(tmp_path / "reorder")
+	writeMetadataFile(folder, "PROD.app", metadataText1.replace("Ent001;Ent002\nEnt001;Ent003", "Ent001;Ent003\nEnt001;Ent002")
+		.replace("C001;N;N;N;;;;;1;DefaultParent=#root;English=C1\nC002;N;N;N;;;;;1;DefaultParent=#root;English=C2",
+		"C002;N;N;N;;;;;1;DefaultParent=#root;English=C2\nC001;N;N;N;;;;;1;DefaultParent=#root;English=C1"))
+	compareFiles(folder, "--report-reorder", *options)
+	workbook = openpyxl.load_workbook(glob.glob(os.path.join(str(folder), "Results_*.xlsx"))[0], read_only=True)
+	try:
+		orderRows = [list(row[:5]) for row in workbook.worksheets[0].iter_rows(values_only=True) if row[2] == "Order"]
+	finally:
+		workbook.close()
+	assert orderRows == [["Entity", "Ent001;Ent002", "Order", "2", "3"], ["Custom1", "C001", "Order", "1", "2"]]
+
+def getSixCustomsText(custom6TopMember, enableCustom6Aggr, switchSignForFlow):
+	accountProperties = ["Acc001", "REVENUE", "N", "Y", "N", ""] + 5 * ["[None]"] + [custom6TopMember, "2", "N"] + 5 * ["Y"] + [enableCustom6Aggr]
+	accountProperties = accountProperties + ["", "", "", "", "", "[ICP Top]", "N", "", "1", "DefaultParent=#root", "English=Account 1"]
+	return """!FILE_FORMAT=11.12
+!CUSTOM_ORDER=Custom1;Custom2;Custom3;Custom4;Custom5;Products
+!MEMBERS=Account
+{}
+!MEMBERS=Products
+P001;N;{};N;;;;;1;DefaultParent=#root;English=Product 1
+""".format(";".join(accountProperties), switchSignForFlow)
+
+@pytest.mark.parametrize("options", [[], ["-m"]])
+def test_properties_are_named_after_six_customs(tmp_path, options):
+	writeMetadataFile(tmp_path, "QA.app", getSixCustomsText("[None]", "Y", "N"))
+	writeMetadataFile(tmp_path, "PROD.app", getSixCustomsText("P001", "N", "Y"))
+	assert sorted(compareFiles(tmp_path, *options)[1:]) == [
+		["Account", "Acc001", "Custom6TopMember", "[None]", "P001"],
+		["Account", "Acc001", "EnableCustom6Aggr", "Y", "N"],
+		["Products", "P001", "SwitchSignForFlow", "N", "Y"]]